@@ -0,0 +1,56 @@
+"""
+Benchmarks of Cosmos at scale.  They are not part of the installed package, run them from the repository's root, ex:
+
+    python -m benchmarks.persistence --sizes 1000 10000 100000 1000000 --output persistence.json
+
+Each benchmark prints its results as JSON, along with the versions it ran against, so runs from different versions
+of Cosmos can be compared.
+"""
+import os
+import sys
+import json
+import time
+import platform
+from contextlib import contextmanager
+
+import sqlalchemy
+import networkx
+
+
+def environment():
+    from cosmos import __version__
+
+    return dict(cosmos=__version__,
+                python=platform.python_version(),
+                sqlalchemy=sqlalchemy.__version__,
+                networkx=networkx.__version__,
+                platform=platform.platform())
+
+
+@contextmanager
+def timed(results, key):
+    """Stores the wall time of the block, in seconds, in results[key]"""
+    start = time.time()
+    try:
+        yield
+    finally:
+        results[key] = round(time.time() - start, 4)
+
+
+def write_results(benchmark, results, output=None):
+    """
+    :param str benchmark: the benchmark's name
+    :param list results: a dict per run of the benchmark
+    :param str output: a path to write the JSON to, defaults to stdout
+    """
+    doc = dict(benchmark=benchmark, environment=environment(), results=results)
+    if output:
+        with open(output, 'w') as fh:
+            json.dump(doc, fh, indent=2, sort_keys=True)
+    else:
+        json.dump(doc, sys.stdout, indent=2, sort_keys=True)
+        sys.stdout.write('\n')
+
+
+def log(msg):
+    print >> sys.stderr, '[%s] %s' % (time.strftime('%H:%M:%S'), msg)
@@ -0,0 +1,75 @@
+"""
+Synthetic DAGs of NOOP tools, shaped like real pipelines.  Every task has an output file, and children find their
+parents' outputs through abstract input files, so adding them does the same TaskFile work as real tools do.
+"""
+from cosmos import Tool, NOOP, abstract_input_taskfile as aif, abstract_output_taskfile as aof
+
+DEPTH = 100  # stages in the `deep` shape
+FAN_IN = 100  # parents of each merge task in the `fan_in` shape
+
+
+class Source(Tool):
+    noop = True
+
+    def cmd(self, shard, out_txt=aof('out.txt')):
+        return NOOP if self.noop else 'touch %s' % out_txt
+
+
+class Step(Tool):
+    noop = True
+
+    def cmd(self, shard, in_txt=aif(format='txt'), out_txt=aof('out.txt')):
+        return NOOP if self.noop else 'touch %s' % out_txt
+
+
+class Merge(Tool):
+    noop = True
+
+    def cmd(self, group, in_txts=aif(format='txt', n='>=1'), out_txt=aof('out.txt')):
+        return NOOP if self.noop else 'touch %s' % out_txt
+
+
+# the same tools, but with a command that has to be submitted to a DRM
+class SourceJob(Source):
+    noop = False
+
+
+class StepJob(Step):
+    noop = False
+
+
+class MergeJob(Merge):
+    noop = False
+
+
+def tools(noop):
+    return (Source, Step, Merge) if noop else (SourceJob, StepJob, MergeJob)
+
+
+def wide(execution, size, noop=True):
+    """Two stages of size / 2 tasks, the second one2one with the first"""
+    Source, Step, Merge = tools(noop)
+    sources = execution.add((Source(dict(shard=i), out='source/{shard}') for i in range(size // 2)), name='Source')
+    execution.add((Step(dict(shard=t.tags['shard']), [t], out='step/{shard}') for t in sources), name='Step')
+
+
+def deep(execution, size, noop=True, depth=DEPTH):
+    """`depth` stages of size / depth tasks, each one2one with the stage before it, ie. size / depth long chains"""
+    Source, Step, Merge = tools(noop)
+    tasks = execution.add((Source(dict(shard=i), out='source/{shard}') for i in range(max(1, size // depth))),
+                          name='Source')
+    for d in range(1, depth):
+        tasks = execution.add((Step(dict(shard=t.tags['shard']), [t], out='step%s/{shard}' % d) for t in tasks),
+                              name='Step%s' % d)
+
+
+def fan_in(execution, size, noop=True, fan_in=FAN_IN):
+    """Sources merged many2one, `fan_in` at a time"""
+    Source, Step, Merge = tools(noop)
+    n_sources = size * fan_in // (fan_in + 1)
+    sources = execution.add((Source(dict(shard=i), out='source/{shard}') for i in range(n_sources)), name='Source')
+    execution.add((Merge(dict(group=g), sources[i:i + fan_in], out='merge/{group}')
+                   for g, i in enumerate(range(0, n_sources, fan_in))), name='Merge')
+
+
+SHAPES = dict(wide=wide, deep=deep, fan_in=fan_in)
@@ -0,0 +1,72 @@
+"""
+A DRM that completes jobs after configurable latencies, without running anything, so the scheduler can be
+benchmarked on its own.  Importing this module registers it as the `fake` DRM, ex:
+
+    cosmos = Cosmos(database_url, default_drm='fake', drm_options=dict(fake=dict(latency=1)))
+"""
+import time
+import random
+import itertools as it
+
+from cosmos.job.drm import DRM
+
+
+class DRM_Fake(DRM):
+    name = 'fake'
+    supports_dependencies = True
+
+    def __init__(self, jobmanager, latency=0, jitter=0, submit_latency=0, poll_latency=0, seed=0):
+        """
+        :param float latency: seconds each job runs for.
+        :param float jitter: up to this many seconds are added to each job's latency, at random.
+        :param float submit_latency: seconds each call to submit a batch of jobs takes, ex. a bsub round trip.
+        :param float poll_latency: seconds each poll for finished jobs takes, ex. a bjobs round trip.
+        """
+        self.jobmanager = jobmanager
+        self.latency = latency
+        self.jitter = jitter
+        self.submit_latency = submit_latency
+        self.poll_latency = poll_latency
+        self._random = random.Random(seed)
+        self._job_ids = it.count(1)
+        self.finishes = dict()  # job id, as drm_jobID is stored, a str -> time the job finishes
+        self.submitted_on = dict()  # task -> time
+        self.finished_on = dict()  # task -> time
+
+    def dependency_specification(self, job_ids):
+        return ''
+
+    def submit_job(self, task):
+        self.submit_jobs([task])
+
+    def submit_jobs(self, tasks):
+        time.sleep(self.submit_latency)
+        now = time.time()
+        for task in tasks:
+            task.drm_jobID = str(next(self._job_ids))
+            # a job held on its parents starts once they have all finished
+            start = max([now] + [self.finishes.get(str(job_id), now) for job_id in task.drm_dependencies])
+            self.finishes[task.drm_jobID] = start + self.latency + self._random.uniform(0, self.jitter)
+            self.submitted_on[task] = now
+
+    def filter_is_done(self, tasks):
+        time.sleep(self.poll_latency)
+        now = time.time()
+        done = [t for t in tasks if self.finishes.get(str(t.drm_jobID), 0) <= now]
+        for task in done:
+            # the outcome is known, so the job manager does not wait for a profile
+            task.exit_status = 0
+            self.finished_on[task] = self.finishes.pop(str(task.drm_jobID), now)
+        return done
+
+    def drm_statuses(self, tasks):
+        now = time.time()
+        return {t.drm_jobID: 'RUN' if self.finishes.get(str(t.drm_jobID), 0) > now else 'DONE' for t in tasks}
+
+    def kill_tasks(self, tasks, wait=True):
+        for task in tasks:
+            self.finishes.pop(str(task.drm_jobID), None)
+
+    def kill(self, task):
+        self.kill_tasks([task])
+
@@ -0,0 +1,104 @@
+"""
+Times building, persisting, resuming and deleting synthetic DAGs on SQLite.
+
+For each shape and size, in a fresh database:
+
+* add: Execution.add of the whole DAG
+* run_dry: Execution.run(dry=True), which builds the task graph and does the first commit of the new tasks.
+  first_commit is inserting the new tasks and that commit on their own, and task_graph is building the graph.
+* resume_start: Cosmos.start of the finished execution, in a new session.  Every task is marked successful first,
+  as if the DAG had run.
+* resume_add: adding the same DAG to the resumed execution, which finds the existing tasks
+* delete: Execution.delete
+
+usage: python -m benchmarks.persistence [--shapes wide deep fan_in] [--sizes 1000 10000] [--output results.json]
+"""
+import os
+import shutil
+import argparse
+import tempfile
+import logging
+
+from cosmos import Cosmos, Task, TaskStatus, ExecutionStatus
+from . import timed, write_results, log
+from .dags import SHAPES
+
+
+def run_persistence(shape, size, work_dir):
+    results = dict(shape=shape, size=size)
+    db_path = os.path.join(work_dir, 'cosmos.sqlite')
+    output_dir = os.path.join(work_dir, 'out')
+    name = '%s_%s' % (shape, size)
+
+    cosmos = Cosmos('sqlite:///%s' % db_path)
+    cosmos.initdb()
+    session = cosmos.session
+    ex = cosmos.start(name, output_dir, skip_confirm=True)
+    quiet(ex)
+
+    with timed(results, 'add'):
+        SHAPES[shape](ex, size)
+    results['tasks'] = len(ex.tasks)
+
+    with timed(results, 'run_dry'):
+        ex.run(dry=True)
+    spans = ex.jobmanager.timings.summary()
+    # older versions inserted the tasks in the commit
+    results['first_commit'] = round(spans['session.commit']['total'] + spans.get('bulk_insert', {}).get('total', 0), 4)
+    results['task_graph'] = spans['task_graph']['total']
+
+    # pretend the DAG ran
+    session.query(Task).update({Task.successful: True, Task._status: TaskStatus.successful},
+                               synchronize_session=False)
+    ex.status = ExecutionStatus.successful
+    session.commit()
+    # load the status before detaching, it is checked atexit by the handler run() registered
+    ex.status
+    session.remove()
+
+    with timed(results, 'resume_start'):
+        ex = cosmos.start(name, output_dir, skip_confirm=True)
+    quiet(ex)
+    with timed(results, 'resume_add'):
+        SHAPES[shape](ex, size)
+    assert len(ex.tasks) == results['tasks'], 'resuming created new tasks'
+
+    with timed(results, 'delete'):
+        ex.delete(delete_files=False)
+
+    session.remove()
+    results['db_size_mb'] = round(os.path.getsize(db_path) / 2. ** 20, 1)
+    return results
+
+
+def quiet(execution):
+    """Keep the benchmark's output to its results"""
+    for h in execution.log.handlers:
+        if isinstance(h, logging.StreamHandler) and not isinstance(h, logging.FileHandler):
+            h.setLevel(logging.WARNING)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--shapes', nargs='+', choices=sorted(SHAPES), default=sorted(SHAPES))
+    parser.add_argument('--sizes', nargs='+', type=int, default=[1000, 10000],
+                        help='number of tasks in each DAG, up to 1000000')
+    parser.add_argument('--output', help='write the JSON results here, rather than to stdout')
+    parser.add_argument('--work_dir', help='where to create the databases, defaults to a temporary directory')
+    args = parser.parse_args()
+
+    results = []
+    for size in args.sizes:
+        for shape in args.shapes:
+            work_dir = tempfile.mkdtemp(prefix='cosmos_bench_', dir=args.work_dir)
+            try:
+                log('%s %s tasks' % (shape, size))
+                results.append(run_persistence(shape, size, work_dir))
+                log(results[-1])
+            finally:
+                shutil.rmtree(work_dir)
+    write_results('persistence', results, args.output)
+
+
+if __name__ == '__main__':
+    main()
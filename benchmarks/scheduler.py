@@ -0,0 +1,155 @@
+"""
+Times the scheduler running synthetic DAGs of tools that have commands, ie. that are submitted to a DRM.
+
+By default jobs go to the fake DRM (see benchmarks/fake_drm.py), which runs nothing, so only the scheduler is measured.
+With --drm lsf, --drm ge or --drm slurm, the real DRM_LSF, DRM_GE or DRM_SLURM code runs against the stub commands in
+benchmarks/bin, which run jobs on this machine.
+
+For each shape and size:
+
+* run: seconds in Execution.run, and tasks_per_second, the number of tasks divided by that
+* scheduling_latency: seconds from a task's last parent finishing to the task being submitted (fake DRM only)
+* cpu_run, cpu_run_queued_and_ready_tasks: CPU seconds spent in _run, and in the part of it that submits tasks
+* spans: the scheduler's own timings, see cosmos.util.timing
+
+usage: python -m benchmarks.scheduler [--drm fake] [--latency 0] [--shapes ...] [--sizes 1000 10000]
+"""
+import os
+import sys
+import shutil
+import argparse
+import resource
+import tempfile
+from contextlib import contextmanager
+from functools import wraps
+
+from cosmos import Cosmos, TaskStatus
+from . import timed, write_results, log
+from .dags import SHAPES
+from .fake_drm import DRM_Fake  # importing it registers the fake DRM
+from .persistence import quiet
+
+STUB_BIN = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'bin')
+
+
+def cpu_seconds():
+    usage = resource.getrusage(resource.RUSAGE_SELF)
+    return usage.ru_utime + usage.ru_stime
+
+
+@contextmanager
+def cpu_timed(results, names):
+    """
+    Accumulates the CPU time spent in functions of cosmos.models.Execution in results['cpu' + name], for the duration
+    of the block.
+    """
+    module = sys.modules['cosmos.models.Execution']
+    originals = {name: getattr(module, name) for name in names}
+
+    def wrap(name, func):
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            start = cpu_seconds()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                key = 'cpu' + name
+                results[key] = round(results.get(key, 0) + cpu_seconds() - start, 4)
+
+        return wrapper
+
+    for name, func in originals.items():
+        setattr(module, name, wrap(name, func))
+    try:
+        yield
+    finally:
+        for name, func in originals.items():
+            setattr(module, name, func)
+
+
+def distribution(values):
+    values = sorted(values)
+    if not values:
+        return None
+    return dict(count=len(values),
+                mean=round(sum(values) / len(values), 4),
+                p50=round(values[len(values) // 2], 4),
+                p95=round(values[int(len(values) * .95)], 4),
+                max=round(values[-1], 4))
+
+
+def scheduling_latencies(tasks, fake_drm):
+    for task in tasks:
+        parents = task.parents
+        if parents and task in fake_drm.submitted_on:
+            last_parent = max(fake_drm.finished_on[p] for p in parents)
+            # a task held by drm dependencies is submitted before its parents finish
+            yield max(0, fake_drm.submitted_on[task] - last_parent)
+
+
+def run_scheduler(shape, size, work_dir, drm, drm_options, drm_dependencies):
+    results = dict(shape=shape, size=size, drm=drm, drm_options=drm_options, drm_dependencies=drm_dependencies)
+    cosmos = Cosmos('sqlite:///%s' % os.path.join(work_dir, 'cosmos.sqlite'), default_drm=drm,
+                    drm_options={drm: drm_options})
+    cosmos.initdb()
+    ex = cosmos.start('%s_%s' % (shape, size), os.path.join(work_dir, 'out'), skip_confirm=True)
+    quiet(ex)
+    SHAPES[shape](ex, size, noop=False)
+    tasks = ex.tasks
+    results['tasks'] = len(tasks)
+
+    with cpu_timed(results, ['_run', '_run_queued_and_ready_tasks']), timed(results, 'run'):
+        results['successful'] = ex.run(drm_dependencies=drm_dependencies)
+    results['tasks_per_second'] = round(len(tasks) / results['run'], 1)
+    assert all(t.status == TaskStatus.successful for t in tasks), 'not every task succeeded'
+
+    if drm == 'fake':
+        results['scheduling_latency'] = distribution(list(scheduling_latencies(tasks, ex.jobmanager.drms['fake'])))
+    results['spans'] = ex.jobmanager.timings.summary()
+    # load the status before detaching, it is checked atexit by the handler run() registered
+    ex.status
+    cosmos.session.remove()
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--drm', choices=['fake', 'local', 'lsf', 'ge', 'slurm'], default='fake')
+    parser.add_argument('--latency', type=float, default=0, help='seconds each job runs for')
+    parser.add_argument('--jitter', type=float, default=0, help='fake DRM only, up to this many seconds are added '
+                                                                 'to each job\'s latency')
+    parser.add_argument('--submit_latency', type=float, default=0, help='fake DRM only, seconds each submit takes')
+    parser.add_argument('--poll_latency', type=float, default=0, help='fake DRM only, seconds each poll takes')
+    parser.add_argument('--drm_dependencies', action='store_true', help='see Execution.run')
+    parser.add_argument('--shapes', nargs='+', choices=sorted(SHAPES), default=sorted(SHAPES))
+    parser.add_argument('--sizes', nargs='+', type=int, default=[1000, 10000],
+                        help='number of tasks in each DAG, up to 100000')
+    parser.add_argument('--output', help='write the JSON results here, rather than to stdout')
+    parser.add_argument('--work_dir', help='where to create the databases, defaults to a temporary directory')
+    args = parser.parse_args()
+
+    if args.drm == 'fake':
+        drm_options = dict(latency=args.latency, jitter=args.jitter, submit_latency=args.submit_latency,
+                           poll_latency=args.poll_latency)
+    else:
+        drm_options = dict()
+        os.environ['STUB_DRM_LATENCY'] = str(args.latency)
+    if args.drm in ['lsf', 'ge', 'slurm']:
+        os.environ['PATH'] = STUB_BIN + os.pathsep + os.environ['PATH']
+
+    results = []
+    for size in args.sizes:
+        for shape in args.shapes:
+            work_dir = tempfile.mkdtemp(prefix='cosmos_bench_', dir=args.work_dir)
+            os.environ['STUB_DRM_DIR'] = os.path.join(work_dir, 'drm_stub')
+            try:
+                log('%s %s tasks on %s' % (shape, size, args.drm))
+                results.append(run_scheduler(shape, size, work_dir, args.drm, drm_options, args.drm_dependencies))
+                log(results[-1])
+            finally:
+                shutil.rmtree(work_dir)
+    write_results('scheduler', results, args.output)
+
+
+if __name__ == '__main__':
+    main()
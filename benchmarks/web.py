@@ -0,0 +1,224 @@
+"""
+Load tests the web dashboard against a SQLite database of large synthetic executions.
+
+The database is filled with SQLAlchemy core inserts, which is much faster than adding the tasks through
+Execution.add, so it can hold a million tasks.  Every execution is a chain of stages, each task with an output file
+that is the input of the task after it in the next stage, and a mix of successful, failed and unattempted tasks with
+resource usage.
+
+Then each view is requested through the Flask test client: the index, the first execution, its last stage and
+one of its tasks.  Each view is requested in a forked process, so they do not share a session or memory:
+
+* latency_first, latency_min: seconds for the first request, and for the fastest of --repeat requests
+* queries: number of SQL statements the first request ran
+* response_kb: size of the response body
+* peak_mem_mb: how much the process' maximum resident set size grew during the requests
+
+usage: python -m benchmarks.web [--sizes 10000 100000] [--executions 10] [--stages 10] [--repeat 3]
+"""
+import os
+import json
+import time
+import shutil
+import random
+import argparse
+import resource
+import tempfile
+import datetime
+import itertools as it
+
+from sqlalchemy import event
+
+from cosmos import Cosmos, Execution, Stage, Task, TaskStatus, StageStatus, ExecutionStatus
+from cosmos.models.Stage import StageEdge
+from cosmos.models.Task import TaskEdge, tags_hash
+from cosmos.models.TaskFile import TaskFile, InputFileAssociation
+from . import timed, write_results, log
+
+CHUNK = 10000  # rows per executemany
+
+
+def insert(conn, table, rows):
+    """Inserts rows, an iterable of dicts, CHUNK at a time"""
+    rows = iter(rows)
+    while True:
+        chunk = list(it.islice(rows, CHUNK))
+        if not chunk:
+            return
+        conn.execute(table.insert(), chunk)
+
+
+def task_rows(rnd, stage_id, first_id, n, now):
+    for i in range(n):
+        status = rnd.random()
+        status = TaskStatus.successful if status < .8 else TaskStatus.failed if status < .9 else TaskStatus.no_attempt
+        tags = dict(shard=i, group=i // 100)
+        row = dict(id=first_id + i, stage_id=stage_id, tags=tags, tags_hash=tags_hash(tags), drm='local',
+                   NOOP=False, _status=status, successful=status == TaskStatus.successful,
+                   cpu_req=1, mem_req=1024, attempt=1, must_succeed=True, drm_jobID=None,
+                   log_dir='log/%s' % (first_id + i), output_dir='out/%s' % (first_id + i),
+                   started_on=None, submitted_on=None, finished_on=None)
+        for field in Task.profile_fields:
+            row[field] = None
+        if status != TaskStatus.no_attempt:
+            wall_time = rnd.randint(1, 3600)
+            row.update(started_on=now, submitted_on=now, finished_on=now + datetime.timedelta(seconds=wall_time),
+                       exit_status=0 if status == TaskStatus.successful else 1, wall_time=wall_time,
+                       cpu_time=wall_time // 2, user_time=wall_time // 2, system_time=0, percent_cpu=50,
+                       avg_rss_mem_kb=rnd.randint(1, 1 << 20), max_rss_mem_kb=1 << 20)
+        yield row
+
+
+def fill(session, executions, tasks_per_execution, stages, seed=0):
+    """
+    Fills the database with `executions` executions, each a chain of `stages` stages of
+    tasks_per_execution / stages tasks.
+
+    :returns: the number of tasks inserted
+    """
+    rnd = random.Random(seed)
+    now = datetime.datetime.now()
+    tasks_per_stage = max(1, tasks_per_execution // stages)
+    conn = session.connection()
+    task_ids = it.count(1)
+    stage_ids = it.count(1)
+    n_tasks = 0
+    for e in range(1, executions + 1):
+        insert(conn, Execution.__table__, [dict(id=e, name='execution_%s' % e, description=None, successful=False,
+                                                output_dir='/tmp/execution_%s' % e, created_on=now, started_on=now,
+                                                finished_on=now, max_cpus=None, max_attempts=1, info=dict(),
+                                                _status=ExecutionStatus.failed)])
+        previous = None
+        for number in range(1, stages + 1):
+            stage_id = next(stage_ids)
+            insert(conn, Stage.__table__, [dict(id=stage_id, number=number, name='Stage%s' % number,
+                                                execution_id=e, successful=False, started_on=now, finished_on=now,
+                                                _status=StageStatus.running_but_failed)])
+            first_id = next(task_ids)
+            # reserve the rest of this stage's task ids
+            for _ in range(tasks_per_stage - 1):
+                next(task_ids)
+            insert(conn, Task.__table__, task_rows(rnd, stage_id, first_id, tasks_per_stage, now))
+            # each task's output file has the same id as the task
+            insert(conn, TaskFile.__table__, (dict(id=first_id + i, task_output_for_id=first_id + i, order=0,
+                                                   path='out/%s/out.txt' % (first_id + i), name='out',
+                                                   format='txt', basename='out.txt', persist=False,
+                                                   duplicate_ok=False)
+                                              for i in range(tasks_per_stage)))
+            if previous:
+                previous_stage_id, previous_first_id = previous
+                insert(conn, StageEdge.__table__, [dict(parent_id=previous_stage_id, child_id=stage_id)])
+                insert(conn, TaskEdge.__table__, (dict(parent_id=previous_first_id + i, child_id=first_id + i)
+                                                  for i in range(tasks_per_stage)))
+                insert(conn, InputFileAssociation.__table__, (dict(task_id=first_id + i, forward=False,
+                                                                   taskfile_id=previous_first_id + i)
+                                                              for i in range(tasks_per_stage)))
+            previous = stage_id, first_id
+            n_tasks += tasks_per_stage
+        log('filled execution_%s, %s tasks so far' % (e, n_tasks))
+    session.commit()
+    return n_tasks
+
+
+def max_rss_mb():
+    # ru_maxrss is in kilobytes on Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.
+
+
+def measure(cosmos, url, repeat):
+    """
+    Requests url `repeat` times.
+
+    :returns: a dict of the view's latency, queries, response size and memory growth
+    """
+    queries = []
+
+    def count(conn, cursor, statement, parameters, context, executemany):
+        queries.append(statement)
+
+    engine = cosmos.sqla.engine
+    event.listen(engine, 'before_cursor_execute', count)
+    client = cosmos.flask_app.test_client()
+    start_mem = max_rss_mb()
+    latencies = []
+    for i in range(repeat):
+        start = time.time()
+        response = client.get(url)
+        latencies.append(time.time() - start)
+        assert response.status_code == 200, '%s returned %s' % (url, response.status_code)
+        if i == 0:
+            n_queries, response_kb = len(queries), len(response.data) / 1024.
+    event.remove(engine, 'before_cursor_execute', count)
+    return dict(url=url, latency_first=round(latencies[0], 4), latency_min=round(min(latencies), 4),
+                queries=n_queries, response_kb=round(response_kb, 1),
+                peak_mem_mb=round(max_rss_mb() - start_mem, 1))
+
+
+def measure_forked(cosmos, url, repeat):
+    """Runs measure() in a child process, so each view starts from the same memory and an empty session"""
+    # the child must not share the parent's database connections
+    cosmos.session.remove()
+    cosmos.sqla.engine.dispose()
+    r, w = os.pipe()
+    pid = os.fork()
+    if pid == 0:
+        os.close(r)
+        try:
+            result = measure(cosmos, url, repeat)
+        except Exception as e:
+            result = dict(url=url, error=repr(e))
+        with os.fdopen(w, 'w') as fh:
+            json.dump(result, fh)
+        os._exit(0)
+    os.close(w)
+    with os.fdopen(r) as fh:
+        result = json.load(fh)
+    os.waitpid(pid, 0)
+    return result
+
+
+def run_web(size, executions, stages, repeat, work_dir):
+    results = dict(size=size, executions=executions, stages=stages)
+    cosmos = Cosmos('sqlite:///%s' % os.path.join(work_dir, 'cosmos.sqlite'))
+    cosmos.initdb()
+    with timed(results, 'fill'):
+        results['tasks'] = fill(cosmos.session, executions, size // executions, stages)
+    results['db_size_mb'] = round(os.path.getsize(os.path.join(work_dir, 'cosmos.sqlite')) / 1024. / 1024, 1)
+
+    with cosmos.flask_app.test_request_context():
+        ex = cosmos.session.query(Execution).filter_by(name='execution_1').one()
+        stage = ex.stages[-1]
+        task = cosmos.session.query(Task).filter_by(stage_id=stage.id).first()
+        urls = dict(index='/', execution=ex.url, stage=stage.url, task=task.url)
+    cosmos.session.remove()
+
+    results['views'] = {view: measure_forked(cosmos, urls[view], repeat)
+                        for view in ['index', 'execution', 'stage', 'task']}
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--sizes', nargs='+', type=int, default=[10000, 100000],
+                        help='total number of tasks in the database, up to 1000000')
+    parser.add_argument('--executions', type=int, default=10)
+    parser.add_argument('--stages', type=int, default=10, help='stages in each execution')
+    parser.add_argument('--repeat', type=int, default=3, help='requests of each view')
+    parser.add_argument('--output', help='write the JSON results here, rather than to stdout')
+    parser.add_argument('--work_dir', help='where to create the databases, defaults to a temporary directory')
+    args = parser.parse_args()
+
+    results = []
+    for size in args.sizes:
+        work_dir = tempfile.mkdtemp(prefix='cosmos_bench_', dir=args.work_dir)
+        try:
+            log('%s tasks in %s executions' % (size, args.executions))
+            results.append(run_web(size, args.executions, args.stages, args.repeat, work_dir))
+            log(results[-1])
+        finally:
+            shutil.rmtree(work_dir)
+    write_results('web', results, args.output)
+
+
+if __name__ == '__main__':
+    main()
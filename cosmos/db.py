@@ -5,7 +5,7 @@ from sqlalchemy import inspect
 from sqlalchemy.engine import Engine
 from sqlite3 import Connection as SQLite3Connection
 from sqlalchemy.orm import scoped_session, sessionmaker
-from sqlalchemy.schema import Column
+from sqlalchemy.schema import Column, UniqueConstraint, AddConstraint
 from sqlalchemy.types import String, Integer
 
 
@@ -33,6 +33,97 @@ def set_sqlite_pragma(dbapi_connection, connection_record):
         cursor.close()
 
 
+#: PRAGMAs of the SQLite performance profile, see Cosmos(sqlite_profile=True).  WAL lets the web dashboard read while
+#: the scheduler writes, and the busy timeout makes a writer wait for a lock rather than fail.
+SQLITE_PROFILE = OrderedDict([('journal_mode', 'WAL'),
+                              ('synchronous', 'NORMAL'),
+                              ('cache_size', -64000),  # in KiB when negative, ie. 64MB
+                              ('mmap_size', 268435456),
+                              ('busy_timeout', 30000)])  # milliseconds
+
+
+def set_sqlite_profile(engine, pragmas=SQLITE_PROFILE):
+    """Sets `pragmas` on each new connection of a SQLite engine"""
+
+    @event.listens_for(engine, "connect")
+    def set_pragmas(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        for name, value in pragmas.items():
+            cursor.execute("PRAGMA %s=%s" % (name, value))
+        cursor.close()
+
+
+def missing_columns(bind, metadata):
+    """
+    :returns: (list) the columns of tables that already exist, which the database doesn't have, ex. columns added to
+        the models since the database was initialized.
+    """
+    inspector = inspect(bind)
+    tables = set(inspector.get_table_names())
+    missing = []
+    for table in metadata.sorted_tables:
+        if table.name in tables:
+            existing = set(column['name'] for column in inspector.get_columns(table.name))
+            missing += [column for column in table.columns if column.name not in existing]
+    return missing
+
+
+def _sql_literal(bind, value):
+    if isinstance(value, bool):
+        if bind.dialect.name == 'sqlite':
+            return '1' if value else '0'
+        return 'true' if value else 'false'
+    if isinstance(value, (int, long, float)):
+        return str(value)
+    return "'%s'" % str(value).replace("'", "''")
+
+
+def add_missing_columns(bind, metadata):
+    """
+    Adds the columns of tables that already exist, which create_all() skips.  A NOT NULL column must have a scalar
+    default, which the existing rows get.
+
+    :returns: (list) the columns added
+    """
+    columns = missing_columns(bind, metadata)
+    for column in columns:
+        sql = 'ALTER TABLE %s ADD COLUMN %s %s' % (column.table.name, bind.dialect.identifier_preparer.quote(column.name),
+                                                   column.type.compile(dialect=bind.dialect))
+        if column.default is not None and column.default.is_scalar:
+            sql += ' DEFAULT %s' % _sql_literal(bind, column.default.arg)
+        if not column.nullable:
+            assert column.default is not None and column.default.is_scalar, \
+                'cannot add NOT NULL column %s without a scalar default' % column
+            sql += ' NOT NULL'
+        bind.execute(sql)
+    return columns
+
+
+def create_missing_indexes(bind, metadata):
+    """
+    Creates the indexes and unique constraints of tables that already exist, which create_all() skips, ex. indexes
+    added to the models since the database was initialized.  SQLite can't add a constraint to a table, so it gets a
+    unique index of the same name instead.
+    """
+    inspector = inspect(bind)
+    tables = set(inspector.get_table_names())
+    for table in metadata.sorted_tables:
+        if table.name in tables:
+            existing = set(index['name'] for index in inspector.get_indexes(table.name))
+            existing.update(uc['name'] for uc in inspector.get_unique_constraints(table.name))
+            for index in table.indexes:
+                if index.name not in existing:
+                    index.create(bind)
+            for constraint in table.constraints:
+                if isinstance(constraint, UniqueConstraint) and constraint.name not in existing:
+                    if bind.dialect.name == 'sqlite':
+                        quote = bind.dialect.identifier_preparer.quote
+                        bind.execute('CREATE UNIQUE INDEX %s ON %s (%s)' % (
+                            quote(constraint.name), table.name, ', '.join(quote(c.name) for c in constraint.columns)))
+                    else:
+                        bind.execute(AddConstraint(constraint))
+
+
 class Base(declarative_base()):
     __abstract__ = True
     exclude_from_dict = []
@@ -0,0 +1,62 @@
+#
+# Resource usage time series
+#
+from xml.sax.saxutils import escape
+
+MAX_POINTS = 200  # per task, so a stage with many long tasks still draws quickly
+MAX_TASKS = 100  # series read per chart, sampled evenly from larger stages
+WIDTH, HEIGHT, MARGIN = 800, 300, 50
+
+
+def downsample(times, values, max_points=MAX_POINTS):
+    step = max(1, len(times) // max_points)
+    return zip(times[::step], values[::step])
+
+
+def draw_resource_series(series, columns, title=None):
+    """
+    Overlays the resource series of many tasks, in one chart per column, stacked in one svg.  Only a downsampled copy
+    of each task's series is kept, so `series` can stream them from disk one at a time, and each is read just once for
+    all the columns.
+
+    :param series: iterable of (task, dict of column name -> values, including 'time'), ex. from
+        :meth:`cosmos.models.Stage.Stage.resource_series`.
+    :param list columns: the names of the columns to draw.
+    :param str title: a line drawn above the charts.
+    :returns: (str) svg
+    """
+    lines = [(task, dict((column, downsample(s['time'], s[column])) for column in columns)) for task, s in series]
+    lines = [(task, points) for task, points in lines if points[columns[0]]]
+    if not lines:
+        return '<svg xmlns="http://www.w3.org/2000/svg" width="%s" height="%s">' \
+               '<text x="%s" y="%s">no resource series</text></svg>' % (WIDTH, 40, MARGIN, 20)
+
+    top = 20 if title else 0
+    svg = ['<svg xmlns="http://www.w3.org/2000/svg" width="%s" height="%s" font-size="10">' % (
+        WIDTH, top + HEIGHT * len(columns))]
+    if title:
+        svg.append('<text x="%s" y="15">%s</text>' % (MARGIN, escape(title)))
+    for i, column in enumerate(columns):
+        svg.append('<g transform="translate(0,%s)">' % (top + i * HEIGHT))
+        svg += _draw_chart([(task, points[column]) for task, points in lines], column)
+        svg.append('</g>')
+    svg.append('</svg>')
+    return '\n'.join(svg)
+
+
+def _draw_chart(lines, column):
+    max_x = max(x for _, points in lines for x, _ in points) or 1
+    max_y = max(y for _, points in lines for _, y in points) or 1
+
+    def scale(x, y):
+        return (MARGIN + float(x) / max_x * (WIDTH - 2 * MARGIN),
+                HEIGHT - MARGIN - float(y) / max_y * (HEIGHT - 2 * MARGIN))
+
+    svg = ['<path d="M%s %s V%s H%s" stroke="black" fill="none"/>' % (MARGIN, MARGIN, HEIGHT - MARGIN, WIDTH - MARGIN),
+           '<text x="%s" y="%s">%s</text>' % (MARGIN, MARGIN - 10, column),
+           '<text x="5" y="%s">%s</text>' % (MARGIN + 4, max_y),
+           '<text x="%s" y="%s" text-anchor="end">%ss</text>' % (WIDTH - MARGIN, HEIGHT - MARGIN + 15, int(max_x))]
+    for task, points in lines:
+        svg.append('<polyline points="%s" stroke="steelblue" stroke-opacity=".5" fill="none"><title>%s</title>'
+                   '</polyline>' % (' '.join('%.1f,%.1f' % scale(x, y) for x, y in points), escape(str(task))))
+    return svg
@@ -1,44 +1,140 @@
 import os
+import sys
+import time
+import json
+import pipes
 
 opj = os.path.join
 from ..util.helpers import mkdir
-from .local import DRM_Local
-from .lsf import DRM_LSF
-from .ge import DRM_GE
+from .drm import get_drm_classes
+from ..util.timing import Timings
 from .. import TaskStatus, StageStatus, ExecutionStatus, NOOP
 import itertools as it
 from operator import attrgetter
+from collections import Counter
+from multiprocessing.pool import ThreadPool
+
+PROFILER_SCRIPT = opj(os.path.dirname(os.path.realpath(__file__)), 'profiler.py')
+PROFILE_GRACE_PERIOD = 60  # seconds to wait for a finished task's profile to appear on a shared filesystem
+PROFILE_READERS = 8  # threads that read profiles in the background
+ACCOUNTING_INTERVAL = 30  # seconds between batched accounting lookups for tasks that were not profiled
+ACCOUNTING_LOOKUPS = 3  # times to look a task up, since a DRM's accounting can lag behind its jobs finishing
+ACCOUNTING_FIELDS = ['wall_time', 'cpu_time', 'max_rss_mem_kb']
+MAX_REQUEUES = 3  # times a task is resubmitted after the DRM lost its job, without counting as a failed attempt
+
+# appended to every command script, reports the script's exit status to the scheduler through the completions dir.
+# The record is made of numbers only, which printf checks, and the paths are shell quoted.
+COMPLETION_TRAP = """
+cosmos_started=$(date +%s)
+cosmos_report_completion() {{
+    local exit_status=$?
+    printf '{{"task_id": %d, "attempt": %d, "exit_status": %d, "started": %d, "finished": %d}}\\n' \\
+        {task_id:d} {attempt:d} "$exit_status" "$cosmos_started" "$(date +%s)" > {tmp_path}.$$ && mv {tmp_path}.$$ {path}
+}}
+trap cosmos_report_completion EXIT
+"""
 
 
 class JobManager(object):
-    def __init__(self, get_submit_args, default_queue=None):
-        self.drms = dict(local=DRM_Local(self))  # always support local execution
-        self.drms['lsf'] = DRM_LSF(self)
-        self.drms['ge'] = DRM_GE(self)
+    def __init__(self, get_submit_args, default_queue=None, drm_options=None, max_cpus=None, timings=None):
+        """
+        :param dict drm_options: Keyword arguments for each DRM's constructor, keyed by the DRM's name.
+        :param int max_cpus: The maximum number of CPUs the execution will use at once.
+        :param Timings timings: Where to record how long submits, DRM polls and profile reads take.
+        """
+        drm_options = drm_options or dict()
+        self.max_cpus = max_cpus
+        self.timings = timings or Timings()
+        self.drms = {name: drm_class(self, **drm_options.get(name, {}))
+                     for name, drm_class in get_drm_classes().items()}
 
-        self.local_drm = DRM_Local(self)
+        self.local_drm = self.drms['local']
         self.running_tasks = []
+        self.requeues = Counter()
+        self.profile_readers = None
+        self.profile_reads = dict()  # task -> (async result, attempt, job info, whether the task was returned)
+        self.completions_dir = None
+        self.completions = dict()  # running task -> completion record
+        self.last_polled = dict()  # drm name -> time
+        self.pending_accounting = dict()  # finished task that was not profiled -> (attempt, lookups so far)
+        self.last_accounted = time.time()
         self.get_submit_args = get_submit_args
         self.default_queue = default_queue
 
 
     def submit(self, task):
-        self.running_tasks.append(task)
-        task.status = TaskStatus.waiting
-
-        command = task.tool._generate_command(task)
-
-        if command == NOOP:
-            task.NOOP = True
-            task.status = TaskStatus.submitted
-        else:
-            mkdir(task.output_dir)
-            mkdir(task.log_dir)
-            self._create_command_sh(task, command)
-            task.drm_native_specification = self.get_submit_args(task, default_queue=self.default_queue)
-            assert task.drm is not None, 'task has no drm set'
-            self.drms[task.drm].submit_job(task)
-            task.status = TaskStatus.submitted
+        self.submit_tasks([task])
+
+    def submit_tasks(self, tasks, after=None):
+        """
+        Submits `tasks`, handing each DRM all of its tasks at once so it can batch them.
+
+        :param dict after: task -> parent tasks that have already been submitted to the same DRM.  The DRM will hold
+            the task until those parents succeed.
+        """
+        if tasks:
+            with self.timings.span('JobManager.submit'):
+                self._submit_tasks(tasks, after or dict())
+
+    def _submit_tasks(self, tasks, after):
+        drm_tasks = []
+        for task in tasks:
+            self.running_tasks.append(task)
+            task.status = TaskStatus.waiting
+            task.exit_status = None
+            task.drm_dependencies = [p.drm_jobID for p in after.get(task, [])]
+
+            command = task.tool._generate_command(task)
+
+            if command == NOOP:
+                task.NOOP = True
+                task.status = TaskStatus.submitted
+            else:
+                if self.completions_dir is None:
+                    self.completions_dir = opj(task.execution.output_dir, '.cosmos', 'completions')
+                    mkdir(self.completions_dir)
+                self._remove_completion(task)
+                self.completions.pop(task, None)
+                mkdir(task.output_dir)
+                mkdir(task.log_dir)
+                self._create_command_sh(task, command)
+                task.drm_native_specification = self.get_submit_args(task, default_queue=self.default_queue)
+                assert task.drm is not None, 'task has no drm set'
+                drm_tasks.append(task)
+
+        f = attrgetter('drm')
+        for drm, group in it.groupby(sorted(drm_tasks, key=f), f):
+            group = list(group)
+            self.drms[drm].submit_jobs(group)
+            for task in group:
+                task.status = TaskStatus.submitted
+
+    def can_submit(self, task):
+        return self.drms[task.drm].can_submit(task)
+
+    def cancel_tasks(self, tasks):
+        """
+        Kills submitted tasks and returns them to the queue, ex. tasks that were waiting on a parent that failed.
+        Their jobs are not waited on, since they were still pending.  Tasks that have finished in the meantime are
+        left alone, and a task may be given more than once, ex. if several of its parents failed.
+
+        A task whose job the DRM already ended, ex. because a parent failed, but is still waiting for its profile,
+        which it will never write, stops waiting and returns to the queue as well.
+        """
+        tasks = set(tasks)
+        for task in tasks.intersection(self.profile_reads):
+            if not self.profile_reads[task][3]:
+                del self.profile_reads[task]
+                task.status = TaskStatus.no_attempt
+        tasks = tasks.intersection(self.running_tasks)
+        f = attrgetter('drm')
+        for drm, group in it.groupby(sorted(tasks, key=f), f):
+            group = list(group)
+            self.drms[drm].kill_tasks(group, wait=False)
+            for task in group:
+                self.running_tasks.remove(task)
+                self.completions.pop(task, None)
+                task.status = TaskStatus.no_attempt
 
     def terminate(self):
         f = lambda t: t.drm
@@ -49,42 +145,248 @@ class JobManager(object):
                 task.status = TaskStatus.killed
                 task.stage.status = StageStatus.killed
 
+    def shutdown(self):
+        """Lets the DRMs clean up once the execution has finished running tasks"""
+        for drm in self.drms.values():
+            drm.shutdown()
+
 
     def get_finished_tasks(self):
         """
+        Tasks that sent a completion record are finished without asking the DRM.  DRMs with a `poll_interval` are
+        only polled that often, for the tasks that have not sent one, ex. because their job was killed.
+
+        Profiles are read by a pool of background threads, so a slow or missing profile.json never blocks the
+        scheduler.  Tasks whose exit_status is already known are returned right away, and their profile fields are
+        filled in on a later call.
+
+        Tasks whose job the DRM lost are returned with a status of no_attempt, and should be submitted again.
+
         :returns: A completed task, or None if there are no tasks to wait for
         """
         for t in list(self.running_tasks):
             if t.NOOP:
                 self.running_tasks.remove(t)
                 yield t
+        self._read_completions()
         f = attrgetter('drm')
         for drm, tasks in it.groupby(sorted(self.running_tasks, key=f), f):
-            for t in self.drms[drm].filter_is_done(list(tasks)):
+            tasks = list(tasks)
+            poll_interval = self.drms[drm].poll_interval
+            if poll_interval is None:
+                with self.timings.span('poll.%s' % drm):
+                    done = self.drms[drm].filter_is_done(tasks)
+            else:
+                done = [t for t in tasks if t in self.completions]
+                if time.time() - self.last_polled.get(drm, 0) > poll_interval:
+                    self.last_polled[drm] = time.time()
+                    with self.timings.span('poll.%s' % drm):
+                        done += self.drms[drm].filter_is_done([t for t in tasks if t not in self.completions])
+
+            vanished = []
+            for t in done:
                 self.running_tasks.remove(t)
-                try:
-                    t.update_from_profile_output()
-                except IOError as e:
-                    t.log.info(e)
-                    t.execution.status = ExecutionStatus.failed
-                yield t
+                completion = self.completions.pop(t, None)
+                if t.exit_status is not None:
+                    # the DRM already determined the outcome, ex. the task was killed for exceeding its time_req
+                    yield t
+                elif completion is not None:
+                    t.exit_status = completion['exit_status']
+                    self._read_profile(t, completion, outcome_known=True)
+                    yield t
+                elif os.path.exists(t.output_profile_path):
+                    self._read_profile(t)
+                else:
+                    vanished.append(t)
+            if vanished:
+                for t in self._handle_vanished(drm, vanished):
+                    yield t
+
+        for t in self.apply_profiles():
+            yield t
+        self.read_accounting()
+
+    def _handle_vanished(self, drm, tasks):
+        """
+        Asks the DRM's accounting what happened to finished tasks that have not written a profile.  Tasks whose job
+        was lost, ex. its host failed, go back to the queue, without counting as a failed attempt.  The rest wait for
+        their profile to show up.
+
+        :returns: (list) the tasks that went back to the queue, with a status of no_attempt.
+        """
+        with self.timings.span('accounting.%s' % drm):
+            accounting = self.drms[drm].accounting(tasks)
+        requeue = []
+        for t in tasks:
+            info = accounting.get(t, dict())
+            if info.get('lost') and self.requeues[t] < MAX_REQUEUES:
+                self.requeues[t] += 1
+                t.log.warning('%s was lost by the DRM (%s), requeueing it' % (t, info.get('reason')))
+                t.status = TaskStatus.no_attempt
+                requeue.append(t)
+            else:
+                # a lost job is never going to write its profile
+                self._read_profile(t, info, timeout=0 if info.get('lost') else PROFILE_GRACE_PERIOD)
+        return requeue
+
+    def _read_profile(self, task, info=None, outcome_known=False, timeout=PROFILE_GRACE_PERIOD):
+        """
+        Starts reading `task`'s profile in the background.
+
+        :param dict info: what is already known about the job, ex. its exit_status from a completion record.
+        :param bool outcome_known: True if `task` has already been returned with its exit_status.
+        """
+        if self.profile_readers is None:
+            self.profile_readers = ThreadPool(PROFILE_READERS)
+        result = self.profile_readers.apply_async(self.timings.timed('profile_read', read_profile),
+                                                  (task.output_profile_path, timeout))
+        self.profile_reads[task] = (result, task.attempt, info or dict(), outcome_known)
+
+    def apply_profiles(self, wait=False):
+        """
+        Copies the fields of profiles that have been read onto their tasks.  The updates are flushed together with
+        the scheduler's next commit.
+
+        :param bool wait: Wait for every outstanding read, ex. once the last tasks have finished.
+        :returns: (list) tasks whose outcome was waiting on their profile
+        """
+        finished = []
+        for t, (result, attempt, info, outcome_known) in self.profile_reads.items():
+            if wait:
+                result.wait()
+            elif not result.ready():
+                continue
+            del self.profile_reads[t]
+            profile = result.get()
+
+            if outcome_known:
+                if profile is None:
+                    t.log.warning('%s does not exist, so resource usage was not recorded' % t.output_profile_path)
+                elif t.attempt == attempt:
+                    # the exit_status is already known, and may already have triggered a reattempt
+                    profile.pop('exit_status', None)
+                    for k, v in profile.items():
+                        setattr(t, k, v)
+                    if t.skip_profile:
+                        self.pending_accounting[t] = (attempt, 0)
+            else:
+                if profile is None:
+                    t.exit_status = info.get('exit_status')
+                    t.log.warning('%s does not exist, using the exit_status reported by the DRM: %s' % (
+                        t.output_profile_path, t.exit_status))
+                else:
+                    for k, v in profile.items():
+                        setattr(t, k, v)
+                    if t.skip_profile:
+                        self.pending_accounting[t] = (attempt, 0)
+                finished.append(t)
+        return finished
+
+    def read_accounting(self, force=False):
+        """
+        Fills in the resource usage of finished tasks that were not profiled, ex. because of `Tool.skip_profile`, from
+        their DRM's accounting.  Tasks are looked up in one batch per DRM every ACCOUNTING_INTERVAL seconds, and only
+        fields the profile left empty are set.  The updates are flushed together with the scheduler's next commit.
+
+        :param bool force: Look the pending tasks up now, ex. once the last tasks have finished.
+        """
+        if not self.pending_accounting or (not force and time.time() - self.last_accounted < ACCOUNTING_INTERVAL):
+            return
+        self.last_accounted = time.time()
+
+        pending = dict()
+        for t, (attempt, lookups) in self.pending_accounting.items():
+            # a task that has been reattempted since has a different job
+            if t.attempt == attempt and t.status not in [TaskStatus.waiting, TaskStatus.submitted]:
+                pending[t] = (attempt, lookups)
+        self.pending_accounting = dict()
+
+        f = attrgetter('drm')
+        for drm, tasks in it.groupby(sorted(pending, key=f), f):
+            tasks = list(tasks)
+            with self.timings.span('accounting.%s' % drm):
+                accounting = self.drms[drm].accounting(tasks)
+            for t in tasks:
+                info = accounting.get(t)
+                if info is None:
+                    attempt, lookups = pending[t]
+                    if lookups + 1 < ACCOUNTING_LOOKUPS:
+                        self.pending_accounting[t] = (attempt, lookups + 1)
+                    continue
+                for field in ACCOUNTING_FIELDS:
+                    if getattr(t, field) is None and info.get(field) is not None:
+                        setattr(t, field, info[field])
+
+    def _completion_path(self, task):
+        return opj(self.completions_dir, '%s.%s' % (task.id, task.attempt))
+
+    def _remove_completion(self, task):
+        """Removes a stale completion record, ex. from before the task was cancelled and resubmitted"""
+        try:
+            os.remove(self._completion_path(task))
+        except OSError:
+            pass
+
+    def _read_completions(self):
+        """
+        Reads, and removes, the completion records that finished command scripts have written, and keeps the
+        records of running tasks in self.completions.
+        """
+        if self.completions_dir is None:
+            return
+        running = {os.path.basename(self._completion_path(t)): t for t in self.running_tasks}
+        for name in os.listdir(self.completions_dir):
+            if name.startswith('.'):
+                # still being written
+                continue
+            path = opj(self.completions_dir, name)
+            if name in running:
+                with open(path) as fh:
+                    self.completions[running[name]] = json.load(fh)
+            os.remove(path)
 
     def _create_command_sh(self, task, command):
-        """Create a sh script that will execute a command"""
+        """Create a sh script that will execute a command, and report its completion to the scheduler"""
+        path = self._completion_path(task)
         with open(task.output_command_script_path, 'wb') as f:
             f.write('#!/bin/bash\n'
                     'set -e\n'
                     'set -o pipefail\n'
+                    + COMPLETION_TRAP.format(task_id=task.id, attempt=task.attempt, path=pipes.quote(path),
+                                             tmp_path=pipes.quote(opj(self.completions_dir,
+                                                                      '.' + os.path.basename(path)))) +
                     '\n'
                     + command + "\n")
         os.system('chmod 700 "{0}"'.format(task.output_command_script_path))
 
     def get_command_str(self, task):
         "The command to be stored in the command.sh script"
-        p = "psprofile{skip_profile} -w 100 -o {profile_out} {command_script_path}".format(
+        p = "{python} -S {profiler}{skip_profile}{budget} -o {profile_out} {command_script_path}".format(
+            python=sys.executable,
+            profiler=PROFILER_SCRIPT,
             profile_out=task.output_profile_path,
             command_script_path=task.output_command_script_path,
-            skip_profile=' --skip_profile' if task.skip_profile else ''
+            skip_profile=' --skip_profile' if task.skip_profile else
+            ' --series %s' % task.output_resource_series_path,
+            budget=' --budget %s' % task.profile_budget if task.profile_budget else ''
         )
         return p
 
+
+def read_profile(path, timeout):
+    """
+    Runs in a background thread.  Waits up to `timeout` seconds for a profile to appear, since on a shared filesystem
+    it can take a while for a file to propagate.
+
+    :returns: (dict) the profile, or None if it never appeared.
+    """
+    start = time.time()
+    while True:
+        try:
+            with open(path) as fh:
+                return json.load(fh)
+        except (IOError, ValueError):
+            # missing, or still being written
+            if time.time() - start >= timeout:
+                return None
+        time.sleep(.1)
@@ -0,0 +1,128 @@
+"""
+CPU placement for tasks executed by :class:`~cosmos.job.local.DRM_Local`.
+"""
+import os
+import re
+import glob
+import itertools as it
+from distutils.spawn import find_executable
+
+import psutil
+
+# io scheduling class names -> ionice's class numbers
+IONICE_CLASSES = dict(realtime=1,
+                      best_effort=2,
+                      idle=3)
+
+
+def require_program(name):
+    """Raises NotImplementedError if the program `name` is not on the PATH"""
+    if find_executable(name) is None:
+        raise NotImplementedError('%s is required to place tasks, but is not installed' % name)
+
+
+def parse_cpulist(cpulist):
+    """
+    Parses the cpulist format used by /sys, ex: '0-3,8,10-11' -> [0, 1, 2, 3, 8, 10, 11]
+    """
+    cpus = []
+    for r in cpulist.strip().split(','):
+        if not r:
+            continue
+        start, _, end = r.partition('-')
+        cpus += range(int(start), int(end or start) + 1)
+    return cpus
+
+
+def numa_nodes(cpus, sys_path='/sys/devices/system/node'):
+    """
+    :param list cpus: cpu ids to group.
+    :returns: (list of lists) `cpus` grouped by NUMA node.  If /sys does not expose the topology, a single group.
+    """
+    nodes = []
+    for path in sorted(glob.glob(os.path.join(sys_path, 'node[0-9]*', 'cpulist')),
+                       key=lambda p: int(re.search('node(\d+)', p).group(1))):
+        with open(path) as fh:
+            node = [c for c in parse_cpulist(fh.read()) if c in cpus]
+        if node:
+            nodes.append(node)
+
+    placed = set(it.chain(*nodes))
+    unplaced = [c for c in cpus if c not in placed]
+    if unplaced:
+        nodes.append(unplaced)
+    return nodes
+
+
+class CorePool(object):
+    """
+    Hands out disjoint sets of cores.  Allocations are packed onto the fullest NUMA node that can hold them, and only
+    spill across nodes when no single node has enough free cores.
+    """
+
+    def __init__(self, max_cpus=None, numa=True):
+        """
+        :param int max_cpus: The maximum number of cores to hand out.  Defaults to every core this process may run on.
+        :param bool numa: Pack allocations by NUMA node.
+        """
+        cpus = sorted(psutil.Process().cpu_affinity())
+        nodes = numa_nodes(cpus) if numa else [cpus]
+        if max_cpus is not None:
+            # take whole nodes first so the pool itself is as compact as possible
+            keep = set(list(it.chain(*nodes))[:max_cpus])
+            nodes = filter(bool, [[c for c in node if c in keep] for node in nodes])
+
+        self.nodes = nodes
+        self.free = set(it.chain(*nodes))
+        self.allocations = dict()
+
+    def allocate(self, key, n):
+        """
+        :param key: an identifier for the allocation, used to release it later.
+        :param int n: the number of cores to allocate.
+        :returns: (list) the allocated cores, or None if there are not enough free cores.
+        """
+        if key in self.allocations:
+            self.release(key)
+        free_by_node = [[c for c in node if c in self.free] for node in self.nodes]
+        fits = [cores for cores in free_by_node if len(cores) >= n]
+        if fits:
+            cores = min(fits, key=len)[:n]
+        elif len(self.free) >= n:
+            cores = list(it.chain(*sorted(free_by_node, key=len, reverse=True)))[:n]
+        else:
+            return None
+
+        self.free.difference_update(cores)
+        self.allocations[key] = cores
+        return cores
+
+    def release(self, key):
+        self.free.update(self.allocations.pop(key, []))
+
+
+def placement_command(cores=None, nice=None, ionice=None):
+    """
+    The placement is applied by taskset, nice and ionice, which then execute the task's command, so the kernel applies
+    it before the task starts, and everything the task spawns inherits it.  Setting it from Cosmos after the task
+    started would race with the task spawning its processes, and psutil is not safe to use in a preexec_fn while
+    Cosmos runs other threads.
+
+    :param list cores: cores to pin the task to.
+    :param int nice: niceness increment.
+    :param str|tuple ionice: an io scheduling class name ('realtime', 'best_effort', or 'idle'), or a tuple of
+        (class name, priority level).
+    :returns: (str) the prefix to run a command with the placement, or '' if there is nothing to set.
+    """
+    prefix = []
+    if cores:
+        require_program('taskset')
+        prefix.append('taskset -c %s' % ','.join(map(str, cores)))
+    if nice:
+        prefix.append('nice -n %d' % nice)
+    if ionice:
+        name, level = (ionice, None) if isinstance(ionice, basestring) else ionice
+        assert name in IONICE_CLASSES, 'unknown ionice class %s, must be one of %s' % (name, sorted(IONICE_CLASSES))
+        require_program('ionice')
+        prefix.append('ionice -c %d' % IONICE_CLASSES[name] + (' -n %d' % level if level is not None else ''))
+    return ''.join(p + ' ' for p in prefix)
@@ -1,6 +1,67 @@
+import os
+import sys
+import time
+import subprocess as sp
+
+from ..util.iterstuff import chunked
+
+ENTRY_POINT_GROUP = 'cosmos.drms'
+
+KILL_BATCH_SIZE = 500  # job ids per bkill/qdel/scancel call
+MAX_PARALLEL_CALLS = 8
+KILL_CONFIRM_TIMEOUT = 60  # seconds to wait for the DRM to report killed jobs as finished
+
+_registry = dict()
+_loaded_entry_points = False
+
+
+class _DRMMeta(type):
+    """Registers every DRM subclass that sets a `name`"""
+
+    def __init__(cls, name, bases, dct):
+        super(_DRMMeta, cls).__init__(name, bases, dct)
+        if cls.name is not None:
+            _registry[cls.name] = cls
+
+
+def get_drm_classes():
+    """
+    DRMs are registered by subclassing :class:`DRM` and setting its `name`.  Other packages can provide DRMs by
+    advertising their DRM class under the `cosmos.drms` setuptools entry point, ex:
+    ``entry_points={'cosmos.drms': ['mydrm = mypackage.drm:DRM_Mine']}``
+
+    :returns: (dict) DRM name -> DRM class
+    """
+    global _loaded_entry_points
+    # import the built-in DRMs so that they are registered
+    from . import local, lsf, ge, slurm, pool
+
+    if not _loaded_entry_points:
+        _loaded_entry_points = True
+        try:
+            import pkg_resources
+        except ImportError:
+            pass
+        else:
+            for entry_point in pkg_resources.iter_entry_points(ENTRY_POINT_GROUP):
+                try:
+                    entry_point.load()
+                except Exception as e:
+                    # a broken plugin should not stop the other DRMs from being used
+                    print >> sys.stderr, '*** ERROR loading DRM plugin %s: %s: %s' % (entry_point,
+                                                                                 e.__class__.__name__, e)
+
+    return dict(_registry)
+
+
 class DRM(object):
     "DRM base class"
+    __metaclass__ = _DRMMeta
     name = None
+    supports_dependencies = False
+    #: Seconds between polls for jobs that have not sent a completion record.  None polls on every loop, which is
+    #: right for DRMs that are cheap to poll.
+    poll_interval = None
 
     def __init__(self, jobmanager):
         self.jobmanager = jobmanager
@@ -8,9 +69,69 @@ class DRM(object):
     def submit_job(self, task):
         raise NotImplementedError
 
+    def submit_jobs(self, tasks):
+        """
+        Submits a batch of tasks.  DRMs that can submit many jobs at once should override this.
+        """
+        for task in tasks:
+            self.submit_job(task)
+
+    def dependency_specification(self, job_ids):
+        """
+        :returns: (str) native arguments that hold a job until the jobs in `job_ids` have finished successfully.
+        """
+        raise NotImplementedError
+
+    @classmethod
+    def get_submit_args(cls, task, default_queue=None):
+        """
+        Used by :func:`cosmos.default_get_submit_args` to turn a task's resource requirements into native arguments
+        for this DRM.  DRMs that take none, such as local, return None.
+
+        :param cosmos.Task task: The Task being submitted.
+        :param default_queue: The default queue.
+        :rtype: str
+        """
+        return None
+
+    def native_specification(self, task):
+        """
+        :returns: (str) task.drm_native_specification, plus the arguments that make it wait on task.drm_dependencies.
+        """
+        if not task.drm_dependencies:
+            return task.drm_native_specification
+        return ' '.join(filter(None, [task.drm_native_specification,
+                                      self.dependency_specification(task.drm_dependencies)]))
+
+    def submit_command(self, command, stdout_path, stderr_path, native_specification=None):
+        """
+        Submits a shell command that does not belong to a Task, such as a worker of a :class:`~cosmos.job.pool.DRM_Pool`.
+
+        :returns: the job's drm_jobID
+        """
+        raise NotImplementedError
+
+    def can_submit(self, task):
+        """
+        :returns: (bool) False if `task` should be held back for now.
+        """
+        return True
+
     def filter_is_done(self, tasks):
         raise NotImplementedError
 
+    def accounting(self, tasks):
+        """
+        Looks up finished jobs in the DRM's accounting, ex. for jobs that vanished without writing a profile, or to
+        fill in the resource usage of tasks that were not profiled.
+
+        :returns: (dict) task -> dict with the job's `exit_status`, and `lost`, which is True if the job died for
+            reasons that had nothing to do with the task, such as its host failing, along with the `reason`.  DRMs that
+            know the job's resource usage also include `wall_time`, `cpu_time` and `max_rss_mem_kb`.  Tasks the DRM
+            knows nothing about are left out.
+        """
+        return dict()
+
     def drm_statuses(self, tasks):
         raise NotImplementedError
 
@@ -18,6 +139,54 @@ class DRM(object):
     def kill(self, task):
         raise NotImplementedError
 
-    def kill_tasks(self, tasks):
+    def kill_tasks(self, tasks, wait=True):
+        """
+        :param bool wait: Wait for the DRM to confirm that the jobs have exited.  Jobs that were still pending, ex.
+            on a dependency, do not need it.
+        """
         for t in tasks:
-            self.kill(t)
\ No newline at end of file
+            self.kill(t)
+
+    def shutdown(self):
+        """
+        Called when the execution has finished running tasks, ex. to stop long lived workers.
+        """
+        pass
+
+    def wait_until_done(self, tasks, timeout=KILL_CONFIRM_TIMEOUT, interval=1):
+        """
+        Polls the DRM until it reports all of `tasks` as finished, ex. to confirm that they were killed.
+
+        :returns: (list) the tasks that were still not finished after `timeout` seconds.
+        """
+        remaining = list(tasks)
+        deadline = time.time() + timeout
+        while remaining:
+            done = set(self.filter_is_done(remaining))
+            remaining = [t for t in remaining if t not in done]
+            if not remaining or time.time() > deadline:
+                break
+            time.sleep(interval)
+
+        if remaining and hasattr(remaining[0], 'log'):
+            remaining[0].log.warning('%s jobs were still not finished %s seconds after being killed, ex. %s' % (
+                len(remaining), timeout, remaining[0]))
+        return remaining
+
+
+def call_batched(make_args, job_ids, batch_size=KILL_BATCH_SIZE, max_parallel=MAX_PARALLEL_CALLS, preexec_fn=None):
+    """
+    Runs a command, such as bkill, on batches of `job_ids`, with up to `max_parallel` commands running at once, and
+    waits for all of them to finish.
+
+    :param callable make_args: batch of job ids -> the command's arguments, ex. ``lambda ids: ['bkill'] + ids``.
+    :returns: (list) the return code of each command.
+    """
+    running, returncodes = [], []
+    with open(os.devnull, 'w') as devnull:
+        for batch in chunked(map(str, job_ids), batch_size):
+            if len(running) >= max_parallel:
+                returncodes.append(running.pop(0).wait())
+            running.append(sp.Popen(make_args(list(batch)), stdout=devnull, preexec_fn=preexec_fn))
+        returncodes += [p.wait() for p in running]
+    return returncodes
\ No newline at end of file
@@ -1,26 +1,47 @@
 import subprocess as sp
 import re
 import os
+import math
+import getpass
 
-from ..util.iterstuff import grouper
-from .drm import DRM
+from .drm import DRM, call_batched
 
 
 class DRM_GE(DRM):
     name = 'ge'
+    # -hold_jid releases a job once the jobs it waits on finish, even if they failed, so Cosmos never submits a task
+    # before its parents have succeeded
+    supports_dependencies = False
+    poll_interval = 60
 
     def submit_job(self, task):
-        ns = ' ' + task.drm_native_specification if task.drm_native_specification else ''
-        qsub = 'qsub -o {stdout} -e {stderr} -b y -cwd -S /bin/bash -V{ns} '.format(stdout=task.output_stdout_path,
-                                                                                    stderr=task.output_stderr_path,
+        task.drm_jobID = self.submit_command(self.jobmanager.get_command_str(task), task.output_stdout_path,
+                                             task.output_stderr_path, self.native_specification(task))
+
+    @classmethod
+    def get_submit_args(cls, task, default_queue=None):
+        default_job_priority = None
+        use_mem_req = False
+        cpu_req = task.cpu_req
+        mem_req = task.mem_req
+        jobname = '%s_task(%s)' % (task.stage.name, task.id)
+        queue = ' -q %s' % default_queue if default_queue else ''
+        priority = ' -p %s' % default_job_priority if default_job_priority else ''
+        mem_req_s = ' -l h_vmem=%sM' % int(math.ceil(mem_req / float(cpu_req))) if mem_req and use_mem_req else ''
+        return '-pe smp {cpu_req}{queue}{mem_req_s}{priority} -N "{jobname}"'.format(**locals())
+
+    def submit_command(self, command, stdout_path, stderr_path, native_specification=None):
+        ns = ' ' + native_specification if native_specification else ''
+        qsub = 'qsub -o {stdout} -e {stderr} -b y -cwd -S /bin/bash -V{ns} '.format(stdout=stdout_path,
+                                                                                    stderr=stderr_path,
                                                                                     ns=ns)
 
-        out = sp.check_output('{qsub} "{cmd_str}"'.format(cmd_str=self.jobmanager.get_command_str(task), qsub=qsub),
+        out = sp.check_output('{qsub} "{cmd_str}"'.format(cmd_str=command, qsub=qsub),
                               env=os.environ,
                               preexec_fn=preexec_function,
                               shell=True)
 
-        task.drm_jobID = int(re.search('job (\d+) ', out).group(1))
+        return int(re.search('job (\d+) ', out).group(1))
 
     def filter_is_done(self, tasks):
         if len(tasks):
@@ -39,6 +60,14 @@ class DRM_GE(DRM):
         else:
             return []
 
+    def accounting(self, tasks):
+        "Reads exit codes and resource usage with one qacct call, for the user's jobs since `tasks` were submitted"
+        if not tasks:
+            return dict()
+        submitted_on = [t.submitted_on for t in tasks]
+        jobs = qacct_all(since=None if None in submitted_on else min(submitted_on))
+        return {t: jobs[str(t.drm_jobID)] for t in tasks if str(t.drm_jobID) in jobs}
+
     def drm_statuses(self, tasks):
         """
         :param tasks: tasks that have been submitted to the job manager
@@ -57,13 +86,13 @@ class DRM_GE(DRM):
 
     def kill(self, task):
         "Terminates a task"
-        raise NotImplementedError
+        self.kill_tasks([task])
 
-    def kill_tasks(self, tasks):
-        for group in grouper(tasks, 50):
-            group = filter(lambda x: x is not None, group)
-            pids = ','.join(map(lambda t: str(t.drm_jobID), group))
-            sp.Popen(['qdel', pids], preexec_fn=preexec_function)
+    def kill_tasks(self, tasks, wait=True):
+        "Terminates tasks with batched, parallel qdel calls, and waits for them to leave the queue"
+        call_batched(lambda ids: ['qdel', ','.join(ids)], [t.drm_jobID for t in tasks], preexec_fn=preexec_function)
+        if wait:
+            self.wait_until_done(tasks)
 
 
 def qstat_all():
@@ -83,6 +112,52 @@ def qstat_all():
     return bjobs
 
 
+def qacct_all(since=None):
+    """
+    :param datetime since: only read jobs that started after this, so qacct does not report on the user's whole history
+    :returns: (dict) job id -> dict(exit_status, lost, reason, wall_time, cpu_time, max_rss_mem_kb), for the user's jobs
+        that are in the accounting file
+    """
+    args = ['qacct', '-o', getpass.getuser()]
+    if since is not None:
+        args += ['-b', since.strftime('%Y%m%d%H%M')]
+    try:
+        out = sp.check_output(args + ['-j'], stderr=open(os.devnull, 'w'), preexec_fn=preexec_function)
+    except (sp.CalledProcessError, OSError):
+        return {}
+    jobs = dict()
+    # records are separated by a line of =s.  A job that was rerun has a record per run, and the last one is kept.
+    for record in re.split('\n=+\n', '\n' + out):
+        acct = dict()
+        for l in record.split('\n'):
+            items = l.split(None, 1)
+            if len(items) == 2:
+                acct[items[0]] = items[1].strip()
+        if 'jobnumber' in acct and 'failed' in acct:
+            jobs[acct['jobnumber']] = parse_qacct(acct)
+    return jobs
+
+
+def parse_qacct(acct):
+    """
+    :param dict acct: a qacct record, field -> value
+    :returns: (dict) dict(exit_status, lost, reason, wall_time, cpu_time, max_rss_mem_kb)
+    """
+    # failed codes 1-99 mean the job could not be started, ex. its host had a problem.  100 means it was killed.
+    failed = int(acct['failed'].split()[0])
+    exit_status = int(acct['exit_status'].split()[0]) if 'exit_status' in acct else None
+
+    def number(key):
+        # ex. '12.000' or '12s'
+        m = re.match('([\d.]+)', acct.get(key, ''))
+        return int(round(float(m.group(1)))) if m else None
+
+    return dict(exit_status=exit_status, lost=0 < failed < 100, reason=acct['failed'],
+                wall_time=number('ru_wallclock'), cpu_time=number('cpu'),
+                # ru_maxrss is in kB, and 0 where the execution host does not report it
+                max_rss_mem_kb=number('ru_maxrss') or None)
+
+
 def preexec_function():
     # Ignore the SIGINT signal by setting the handler to the standard
     # signal handler SIG_IGN.  This allows Cosmos to cleanly
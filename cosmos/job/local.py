@@ -1,43 +1,179 @@
 from subprocess import Popen
 import os
+import math
+import signal
+import time
 
 import psutil
 from .drm import DRM
+from .affinity import CorePool, placement_command
 
-from .. import TaskStatus
+from .. import TaskStatus, TIMEOUT_EXIT_STATUS
+
+LOAD_AVERAGE_PERIOD = 60.  # seconds, the time constant of the 1 minute load average
+
+
+def preexec_function():
+    # Put the task in its own process group, so a ctrl+c event is not forwarded to it.  This allows Cosmos to cleanly
+    # terminate jobs, and to signal every process a task spawned at once.
+    os.setpgrp()
 
 
 class DRM_Local(DRM):
     name = 'local'
 
-    def __init__(self, jobmanager):
+    def __init__(self, jobmanager, cpu_affinity=False, numa=True, max_load=None, max_memory_percent=None,
+                 enforce_time_req=True):
+        """
+        :param bool cpu_affinity: Pin each task to a disjoint set of `cpu_req` cores, out of at most `max_cpus` cores.
+        :param bool numa: When pinning, pack each task's cores onto a single NUMA node where possible.
+        :param float max_load: Hold back new tasks while the 1 minute load average is above this.
+        :param float max_memory_percent: Hold back new tasks while more than this percent of the system's memory
+            is in use.
+        :param bool enforce_time_req: Kill a task's process group once it has run for longer than its `time_req`
+            (in minutes).  The task fails with an exit_status of :data:`cosmos.TIMEOUT_EXIT_STATUS`.
+        """
         self.jobmanager = jobmanager
+        self.cpu_affinity = cpu_affinity
+        self.numa = numa
+        self.max_load = max_load
+        self.max_memory_percent = max_memory_percent
+        self.enforce_time_req = enforce_time_req
+        self._core_pool = None
+        self._holding_back = False
+        self._granted = []  # (time, cpu_req) of the tasks can_submit() allowed, which the load average may not show yet
+        self._deadlines = dict()
+        self._procs = dict()  # pid -> Popen, so subprocess never reaps a job before _is_done can read its rusage
+        self._started = dict()
+        self._usage = dict()  # finished unprofiled task -> what wait4 reported about it
+
+    @property
+    def core_pool(self):
+        if self._core_pool is None:
+            self._core_pool = CorePool(max_cpus=self.jobmanager.max_cpus, numa=self.numa)
+        return self._core_pool
+
+    def _allocate_cores(self, task):
+        if not self.cpu_affinity or not task.cpu_req:
+            return None
+        cores = self.core_pool.allocate(task, task.cpu_req)
+        if cores is None:
+            task.log.warning('Not enough free cores to pin %s to %s cores, running it unpinned' % (task, task.cpu_req))
+        return cores
+
+    def _unreflected_load(self):
+        """
+        :returns: (float) how much load the tasks allowed to start recently will still add to the 1 minute load
+            average, which only approaches a new process' load exponentially.  Tasks allowed in the same pass over the
+            ready tasks count fully.
+        """
+        now = time.time()
+        self._granted = [(t, cores) for t, cores in self._granted if now - t < 5 * LOAD_AVERAGE_PERIOD]
+        return sum(cores * math.exp(-(now - t) / LOAD_AVERAGE_PERIOD) for t, cores in self._granted)
+
+    def can_submit(self, task):
+        """
+        Samples the system's load and memory usage, which are separate from the `cpu_req` of running tasks.  The load
+        average lags behind tasks starting, so the cores of tasks that were just allowed to start count towards it.
+        """
+        reasons = []
+        if self.max_load is not None:
+            unreflected = self._unreflected_load()
+            load = os.getloadavg()[0] + unreflected
+            if load > self.max_load:
+                reasons.append('load average %.2f, counting %.2f for tasks just started, > %s' % (
+                    load, unreflected, self.max_load))
+        if self.max_memory_percent is not None:
+            memory_percent = psutil.virtual_memory().percent
+            if memory_percent > self.max_memory_percent:
+                reasons.append('memory usage %s%% > %s%%' % (memory_percent, self.max_memory_percent))
+
+        if reasons and not self._holding_back:
+            task.log.info('Holding back local tasks, %s' % ', '.join(reasons))
+        elif not reasons and self._holding_back:
+            task.log.info('Resuming local tasks')
+        self._holding_back = bool(reasons)
+        if not reasons and self.max_load is not None:
+            self._granted.append((time.time(), task.cpu_req or 0))
+        return not reasons
 
     def submit_job(self, task):
-        p = Popen(self.jobmanager.get_command_str(task),
-                  stdout=open(task.output_stderr_path, 'w'),
-                  stderr=open(task.output_stdout_path, 'w'),
-                  preexec_fn=preexec_function(),
+        cores = self._allocate_cores(task)
+        placement = placement_command(cores, task.nice, task.ionice)
+        task.drm_jobID = self.submit_command(placement + self.jobmanager.get_command_str(task),
+                                             stdout_path=task.output_stderr_path,
+                                             stderr_path=task.output_stdout_path)
+        self._started[task] = time.time()
+        if self.enforce_time_req and task.time_req:
+            self._deadlines[task] = time.time() + task.time_req * 60
+
+    def submit_command(self, command, stdout_path, stderr_path, native_specification=None,
+                       preexec_fn=preexec_function):
+        p = Popen(command,
+                  stdout=open(stdout_path, 'w'),
+                  stderr=open(stderr_path, 'w'),
+                  preexec_fn=preexec_fn,
                   shell=True
                   )
-        task.drm_jobID = p.pid
+        self._procs[p.pid] = p
+        return p.pid
 
     def _is_done(self, task):
+        pid = int(task.drm_jobID)
         try:
-            p = psutil.Process(task.drm_jobID)
-            p.wait(timeout=0)
+            reaped, status, rusage = os.wait4(pid, os.WNOHANG)
+        except OSError:
+            # already reaped, ex. by kill_tasks
+            self._procs.pop(pid, None)
             return True
-        except psutil.TimeoutExpired:
-            pass
-        except psutil.NoSuchProcess:
-            # profile_output = json.load(open(task.output_profile_path, 'r'))
-            # exit_code = profile_output['exit_status']
+        if reaped:
+            self._reaped(task, status, rusage)
+            return True
+
+        if time.time() > self._deadlines.get(task, float('inf')):
+            task.log.warning('%s exceeded its time_req of %s minutes, killing it' % (task, task.time_req))
+            self._kill_process_group(task)
+            task.exit_status = TIMEOUT_EXIT_STATUS
             return True
 
         return False
 
+    def _reaped(self, task, status, rusage):
+        """
+        Keeps the rusage of tasks that are not profiled, for :meth:`accounting`.  It covers the whole command, since
+        a process' rusage includes its waited for children.
+        """
+        p = self._procs.pop(int(task.drm_jobID), None)
+        if p is not None:
+            p.returncode = status
+        started = self._started.pop(task, None)
+        if getattr(task, 'skip_profile', False):
+            exit_status = os.WEXITSTATUS(status) if os.WIFEXITED(status) else 128 + os.WTERMSIG(status)
+            self._usage[task] = dict(exit_status=exit_status, lost=False, reason='exited',
+                                     wall_time=int(round(time.time() - started)) if started else None,
+                                     cpu_time=int(round(rusage.ru_utime + rusage.ru_stime)),
+                                     max_rss_mem_kb=rusage.ru_maxrss)
+
+    def accounting(self, tasks):
+        "Reports the rusage that wait4 returned for unprofiled tasks"
+        return {task: self._usage.pop(task) for task in tasks if task in self._usage}
+
+    def _kill_process_group(self, task):
+        try:
+            os.killpg(int(task.drm_jobID), signal.SIGKILL)
+            psutil.Process(int(task.drm_jobID)).wait(timeout=5)
+        except (OSError, psutil.NoSuchProcess, psutil.TimeoutExpired):
+            pass
+
     def filter_is_done(self, tasks):
-        return filter(self._is_done, tasks)
+        done = filter(self._is_done, tasks)
+        for task in done:
+            self._procs.pop(int(task.drm_jobID), None)
+            self._started.pop(task, None)
+            self._deadlines.pop(task, None)
+            if self.cpu_affinity:
+                self.core_pool.release(task)
+        return done
 
 
     def drm_statuses(self, tasks):
@@ -57,23 +193,27 @@ class DRM_Local(DRM):
 
     def kill(self, task):
         "Terminates a task"
-
-        try:
-            psutil.Process(task.drm_jobID).kill()
-        except psutil.NoSuchProcess:
-            pass
-
-
-    def kill_tasks(self, tasks):
-        for t in tasks:
-            self.kill(t)
-
-
-def preexec_function():
-    # Ignore the SIGINT signal by setting the handler to the standard
-    # signal handler SIG_IGN.  This allows Cosmos to cleanly
-    # terminate jobs when there is a ctrl+c event
-    os.setpgrp()
+        self.kill_tasks([task])
+
+    def kill_tasks(self, tasks, wait=True):
+        "Kills each task's entire process group, then waits for them all to exit, which SIGKILL makes quick"
+        tasks = [t for t in tasks if t.drm_jobID is not None]
+        for task in tasks:
+            try:
+                os.killpg(int(task.drm_jobID), signal.SIGKILL)
+            except OSError:
+                pass
+        deadline = time.time() + 5
+        for task in tasks:
+            try:
+                psutil.Process(int(task.drm_jobID)).wait(timeout=max(deadline - time.time(), 0))
+            except (psutil.NoSuchProcess, psutil.TimeoutExpired):
+                pass
+            self._procs.pop(int(task.drm_jobID), None)
+            self._started.pop(task, None)
+            self._deadlines.pop(task, None)
+            if self.cpu_affinity:
+                self.core_pool.release(task)
 
 
 class JobStatusError(Exception):
@@ -2,7 +2,8 @@ import subprocess as sp
 import re
 import os
 
-from .drm import DRM
+from .drm import DRM, call_batched, KILL_BATCH_SIZE
+from ..util.iterstuff import chunked
 
 
 decode_lsf_state = dict([
@@ -16,22 +17,44 @@ decode_lsf_state = dict([
     ('EXIT', 'job finished, but failed'),
 ])
 
+# job states that mean LSF lost track of the job, ex. its host became unreachable
+LOST_STATES = ['UNKWN', 'ZOMBI']
+
 
 class DRM_LSF(DRM):
     name = 'lsf'
+    supports_dependencies = True
+    poll_interval = 60
 
     def submit_job(self, task):
-        ns = ' ' + task.drm_native_specification if task.drm_native_specification else ''
-        bsub = 'bsub -o {stdout} -e {stderr}{ns} '.format(stdout=task.output_stdout_path,
-                                                          stderr=task.output_stderr_path,
+        task.drm_jobID = self.submit_command(self.jobmanager.get_command_str(task), task.output_stdout_path,
+                                             task.output_stderr_path, self.native_specification(task))
+
+    @classmethod
+    def get_submit_args(cls, task, default_queue=None):
+        use_mem_req = False
+        mem_req = task.mem_req
+        jobname = '%s_task(%s)' % (task.stage.name, task.id)
+        queue = ' -q %s' % default_queue if default_queue else ''
+        rusage = '-R "rusage[mem={mem}] ' if mem_req and use_mem_req else ''
+        time = ' -W 0:{0}'.format(task.time_req) if task.time_req else ''
+        return '-R "{rusage}span[hosts=1]" -n {task.cpu_req}{time}{queue} -J "{jobname}"'.format(**locals())
+
+    def dependency_specification(self, job_ids):
+        return '-w "%s"' % ' && '.join('done(%s)' % jid for jid in job_ids)
+
+    def submit_command(self, command, stdout_path, stderr_path, native_specification=None):
+        ns = ' ' + native_specification if native_specification else ''
+        bsub = 'bsub -o {stdout} -e {stderr}{ns} '.format(stdout=stdout_path,
+                                                          stderr=stderr_path,
                                                           ns=ns)
 
-        out = sp.check_output('{bsub} "{cmd_str}"'.format(cmd_str=self.jobmanager.get_command_str(task), bsub=bsub),
+        out = sp.check_output('{bsub} "{cmd_str}"'.format(cmd_str=command, bsub=bsub),
                               env=os.environ,
-                              preexec_fn=preexec_function(),
+                              preexec_fn=preexec_function,
                               shell=True)
 
-        task.drm_jobID = int(re.search('Job <(\d+)>', out).group(1))
+        return int(re.search('Job <(\d+)>', out).group(1))
 
     def filter_is_done(self, tasks):
         if len(tasks):
@@ -50,6 +73,14 @@ class DRM_LSF(DRM):
         else:
             return []
 
+    def accounting(self, tasks):
+        "Reads exit codes and resource usage with `bjobs -o`, which reports on finished jobs until LSF cleans them up"
+        info = dict()
+        for group in chunked(tasks, KILL_BATCH_SIZE):
+            jobs = bjobs_exit_info([str(t.drm_jobID) for t in group])
+            info.update((t, jobs[str(t.drm_jobID)]) for t in group if str(t.drm_jobID) in jobs)
+        return info
+
     def drm_statuses(self, tasks):
         """
         :param tasks: tasks that have been submitted to the job manager
@@ -68,12 +99,13 @@ class DRM_LSF(DRM):
 
     def kill(self, task):
         "Terminates a task"
-        raise NotImplementedError
-        # os.system('bkill {0}'.format(task.drm_jobID))
+        self.kill_tasks([task])
 
-    def kill_tasks(self, tasks):
-        for t in tasks:
-            sp.check_call(['bkill', str(t.drm_jobID)])
+    def kill_tasks(self, tasks, wait=True):
+        "Terminates tasks with batched, parallel bkill calls, and waits for LSF to confirm they have exited"
+        call_batched(lambda ids: ['bkill'] + ids, [t.drm_jobID for t in tasks], preexec_fn=preexec_function)
+        if wait:
+            self.wait_until_done(tasks)
 
 
 def bjobs_all():
@@ -93,6 +125,52 @@ def bjobs_all():
     return bjobs
 
 
+def bjobs_exit_info(job_ids):
+    """
+    :returns: (dict) job id -> dict(exit_status, lost, reason, wall_time, cpu_time, max_rss_mem_kb), for the jobs in
+        `job_ids` that bjobs still remembers
+    """
+    fields = 'jobid stat exit_code exit_reason run_time cpu_used max_mem delimiter="|"'
+    args = ['bjobs', '-a', '-noheader', '-o', fields] + job_ids
+    try:
+        out = sp.check_output(args, stderr=open(os.devnull, 'w'))
+    except sp.CalledProcessError as e:
+        # bjobs exits non-zero if any of the jobs are not found, but still reports on the rest
+        out = e.output
+    except OSError:
+        return {}
+    jobs = dict()
+    for l in out.strip().split('\n'):
+        if l.count('|') >= 6:
+            items = l.split('|')
+            job_id, stat, exit_code, exit_reason = items[:4]
+            run_time, cpu_used, max_mem = items[-3:]
+            if stat not in ['DONE', 'EXIT'] + LOST_STATES:
+                continue
+            exit_status = 0 if stat == 'DONE' else int(exit_code) if exit_code.isdigit() else None
+            # a job that exited without an exit code never ran its command, but that is also what a pending job that
+            # was bkilled looks like, so only requeue jobs whose host LSF lost track of
+            lost = stat in LOST_STATES
+            jobs[job_id] = dict(exit_status=exit_status, lost=lost, reason=exit_reason.strip('- ') or stat,
+                                wall_time=parse_seconds(run_time), cpu_time=parse_seconds(cpu_used),
+                                max_rss_mem_kb=parse_mem_kb(max_mem))
+    return jobs
+
+
+def parse_seconds(s):
+    """ex. '30 second(s)' -> 30"""
+    m = re.match('([\d.]+)', s.strip())
+    return int(round(float(m.group(1)))) if m else None
+
+
+def parse_mem_kb(s):
+    """ex. '12 Mbytes' -> 12288"""
+    m = re.match('([\d.]+)\s*([KMGT])', s.strip(), re.I)
+    if not m:
+        return None
+    return int(float(m.group(1)) * 1024 ** 'KMGT'.index(m.group(2).upper()))
+
+
 def preexec_function():
     # Ignore the SIGINT signal by setting the handler to the standard
     # signal handler SIG_IGN.  This allows Cosmos to cleanly
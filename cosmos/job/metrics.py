@@ -0,0 +1,129 @@
+"""
+Scheduler metrics in the Prometheus text exposition format.
+
+The scheduler writes its metrics to a file in the execution's output_dir every METRICS_INTERVAL seconds, from state
+it already has in memory, and the web app's /metrics endpoint just concatenates the files of running executions.  A
+scrape therefore never runs SQL aggregates, and never waits on the scheduler.
+"""
+import os
+import time
+from collections import Counter, OrderedDict
+
+from .. import TaskStatus
+from ..util.helpers import mkdir
+
+opj = os.path.join
+
+METRICS_INTERVAL = 15  # seconds between writes of the metrics file
+SPAN_BUCKETS = range(0, 17)  # histogram buckets of 2**i milliseconds, up to about a minute
+
+
+def metrics_path(execution):
+    return opj(execution.output_dir, '.cosmos', 'metrics.prom')
+
+
+def quote(value):
+    return '"%s"' % str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+class _Metrics(object):
+    def __init__(self, execution):
+        self.execution_label = 'execution=%s' % quote(execution.name)
+        self.lines = []
+
+    def family(self, name, type, help):
+        self.lines += ['# HELP %s %s' % (name, help), '# TYPE %s %s' % (name, type)]
+
+    def sample(self, name, value, **labels):
+        labels = ','.join([self.execution_label] + ['%s=%s' % (k, quote(v)) for k, v in sorted(labels.items())])
+        self.lines.append('%s{%s} %s' % (name, labels, value))
+
+
+def format_metrics(execution, task_queue, finished):
+    """
+    :param networkx.DiGraph task_queue: the tasks the scheduler has yet to finish.
+    :param Counter finished: (stage name, task status) -> the number of tasks that have finished with that status.
+    :returns: (str) the scheduler's metrics
+    """
+    jobmanager = execution.jobmanager
+    running = jobmanager.running_tasks
+    queued = Counter()
+    for task, degree in task_queue.in_degree().items():
+        if task.status == TaskStatus.no_attempt:
+            queued[(task.stage.name, 'ready' if degree == 0 else 'pending')] += 1
+    for task in running:
+        queued[(task.stage.name, 'running')] += 1
+
+    m = _Metrics(execution)
+    m.family('cosmos_tasks', 'gauge', 'Tasks in the queue, by stage and state (ready, pending or running).')
+    for (stage, state), n in sorted(queued.items()):
+        m.sample('cosmos_tasks', n, stage=stage, state=state)
+
+    m.family('cosmos_tasks_finished_total', 'counter', 'Tasks that have finished during this run, by stage and status.')
+    for (stage, status), n in sorted(finished.items()):
+        m.sample('cosmos_tasks_finished_total', n, stage=stage, status=status)
+
+    m.family('cosmos_cpus_in_use', 'gauge', 'Sum of the cpu_req of running tasks.')
+    m.sample('cosmos_cpus_in_use', sum(t.cpu_req or 0 for t in running))
+    if execution.max_cpus is not None:
+        m.family('cosmos_max_cpus', 'gauge', 'The execution\'s max_cpus limit.')
+        m.sample('cosmos_max_cpus', execution.max_cpus)
+    m.family('cosmos_mem_req_in_use_mb', 'gauge', 'Sum of the mem_req of running tasks.')
+    m.sample('cosmos_mem_req_in_use_mb', sum(t.mem_req or 0 for t in running))
+    max_memory_percent = getattr(jobmanager.local_drm, 'max_memory_percent', None)
+    if max_memory_percent is not None:
+        m.family('cosmos_local_max_memory_percent', 'gauge',
+                 'Local tasks are held back while more of the system\'s memory than this is in use.')
+        m.sample('cosmos_local_max_memory_percent', max_memory_percent)
+
+    m.family('cosmos_drm_jobs_outstanding', 'gauge', 'Submitted tasks that have not finished yet, by DRM.')
+    for drm, n in sorted(Counter(t.drm for t in running if not t.NOOP).items()):
+        m.sample('cosmos_drm_jobs_outstanding', n, drm=drm)
+
+    m.family('cosmos_span_seconds', 'histogram',
+             'Time spent in parts of the scheduler, ex. session.commit, JobManager.submit and poll.<drm>.')
+    for span, s in sorted(jobmanager.timings.snapshot().items()):
+        cumulative = 0
+        for i in SPAN_BUCKETS:
+            cumulative += s['buckets'].get(i, 0)
+            m.sample('cosmos_span_seconds_bucket', cumulative, span=span, le=2 ** i / 1000.)
+        m.sample('cosmos_span_seconds_bucket', s['count'], span=span, le='+Inf')
+        m.sample('cosmos_span_seconds_sum', s['total'], span=span)
+        m.sample('cosmos_span_seconds_count', s['count'], span=span)
+
+    m.family('cosmos_metrics_timestamp_seconds', 'gauge', 'When the scheduler wrote these metrics.')
+    m.sample('cosmos_metrics_timestamp_seconds', int(time.time()))
+    return '\n'.join(m.lines) + '\n'
+
+
+def write_metrics(execution, task_queue, finished):
+    """
+    Atomically replaces the execution's metrics file, so a scrape never reads half of it.
+    """
+    path = metrics_path(execution)
+    mkdir(os.path.dirname(path))
+    tmp = '%s.%s.tmp' % (path, os.getpid())
+    with open(tmp, 'w') as fh:
+        fh.write(format_metrics(execution, task_queue, finished))
+    os.rename(tmp, path)
+
+
+def merge_metrics(texts):
+    """
+    Combines the metrics of several executions, keeping one HELP and TYPE line per metric.
+
+    :param texts: the contents of metrics files
+    :returns: (str)
+    """
+    families = OrderedDict()  # name -> [header lines, sample lines]
+    for text in texts:
+        name = None
+        for line in text.splitlines():
+            if line.startswith('# HELP ') or line.startswith('# TYPE '):
+                name = line.split(' ')[2]
+                headers = families.setdefault(name, [[], []])[0]
+                if line not in headers:
+                    headers.append(line)
+            elif line.strip() and name is not None:
+                families[name][1].append(line)
+    return ''.join('\n'.join(headers + samples) + '\n' for headers, samples in families.values())
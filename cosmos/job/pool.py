@@ -0,0 +1,189 @@
+import os
+import sys
+import json
+import time
+import itertools as it
+
+from .drm import DRM
+from ..util.helpers import mkdir
+
+opj = os.path.join
+
+WORKER_SCRIPT = opj(os.path.dirname(os.path.realpath(__file__)), 'pool_worker.py')
+
+
+class PoolWorker(object):
+    """
+    A long lived job submitted through another DRM.  Has the attributes that DRM needs to track and kill it.
+    """
+
+    def __init__(self, id, spool_dir):
+        self.id = id
+        self.drm_jobID = None
+        self.output_stdout_path = opj(spool_dir, 'workers', '%s.stdout.txt' % id)
+        self.output_stderr_path = opj(spool_dir, 'workers', '%s.stderr.txt' % id)
+
+    def __repr__(self):
+        return '<PoolWorker[%s] drm_jobID=%s>' % (self.id, self.drm_jobID)
+
+
+class DRM_Pool(DRM):
+    """
+    Runs tasks on a fixed number of long lived workers (pilot jobs), which are submitted through another DRM.  Workers
+    pull task command scripts from a spool directory in the execution's output_dir, which avoids paying the DRM's
+    submission overhead and queue wait for every task.
+    """
+    name = 'pool'
+
+    def __init__(self, jobmanager, backend='local', n_workers=4, worker_native_specification=None, idle_timeout=300):
+        """
+        :param str backend: The name of the DRM to submit workers to.
+        :param int n_workers: The maximum number of workers to run at once.
+        :param str worker_native_specification: Extra arguments used when submitting a worker, ex. a queue.
+        :param int idle_timeout: Workers exit after this many seconds without a task to run.
+        """
+        self.jobmanager = jobmanager
+        self.backend = backend
+        self.n_workers = n_workers
+        self.worker_native_specification = worker_native_specification
+        self.idle_timeout = idle_timeout
+        self.spool_dir = None
+        self.workers = []
+        self._outstanding = dict()  # job name -> task
+        self._worker_ids = it.count(1)
+        self._workers_polled = 0
+
+    def _spool(self, *args):
+        return opj(self.spool_dir, *args)
+
+    def _init_spool(self, task):
+        self.spool_dir = opj(task.execution.output_dir, '.cosmos', 'pool')
+        for d in ['tmp', 'pending', 'running', 'done', 'kill', 'workers']:
+            mkdir(self._spool(d))
+            if d != 'workers':
+                # clear anything left over from a previous run of this execution
+                for name in os.listdir(self._spool(d)):
+                    os.remove(self._spool(d, name))
+        if os.path.exists(self._spool('shutdown')):
+            os.remove(self._spool('shutdown'))
+
+    def _job_name(self, task):
+        return '%s.%s' % (task.id, task.attempt)
+
+    def submit_job(self, task):
+        if self.spool_dir is None:
+            self._init_spool(task)
+
+        name = self._job_name(task)
+        tmp = self._spool('tmp', name)
+        with open(tmp, 'w') as fh:
+            json.dump(dict(command=self.jobmanager.get_command_str(task),
+                           stdout=task.output_stdout_path,
+                           stderr=task.output_stderr_path), fh)
+        os.rename(tmp, self._spool('pending', name))
+        self._outstanding[name] = task
+        task.drm_jobID = task.id
+        self._maintain_workers()
+
+    def _maintain_workers(self):
+        """
+        Replace dead workers, and start new ones while there is more work outstanding than workers.  Workers are only
+        checked every backend.poll_interval, since that can be a call to the backend's scheduler.
+        """
+        backend = self.jobmanager.drms[self.backend]
+        if self.workers and time.time() - self._workers_polled >= (backend.poll_interval or 0):
+            self._workers_polled = time.time()
+            dead = backend.filter_is_done(self.workers)
+            for worker in dead:
+                self.workers.remove(worker)
+            if dead:
+                self._requeue_lost_jobs(dead)
+
+        while len(self.workers) < min(self.n_workers, len(self._outstanding)):
+            worker = PoolWorker(next(self._worker_ids), self.spool_dir)
+            command = '{python} {script} {spool_dir} {worker.id} {idle_timeout}'.format(
+                python=sys.executable, script=WORKER_SCRIPT, spool_dir=self.spool_dir, worker=worker,
+                idle_timeout=self.idle_timeout)
+            worker.drm_jobID = backend.submit_command(command, worker.output_stdout_path, worker.output_stderr_path,
+                                                      self.worker_native_specification)
+            self.workers.append(worker)
+
+    def _requeue_lost_jobs(self, dead_workers):
+        """Put the jobs that dead workers were running back in the queue"""
+        dead_ids = {str(w.id) for w in dead_workers}
+        for running in os.listdir(self._spool('running')):
+            name, _, worker_id = running.rpartition('@')
+            if worker_id in dead_ids:
+                task = self._outstanding.get(name)
+                if task is not None:
+                    task.log.warning('Pool worker %s died while running %s, requeueing it' % (worker_id, task))
+                os.rename(self._spool('running', running), self._spool('pending', name))
+
+    def filter_is_done(self, tasks):
+        if not tasks or self.spool_dir is None:
+            return []
+
+        done = []
+        finished = set(os.listdir(self._spool('done')))
+        for task in tasks:
+            name = self._job_name(task)
+            if name in finished:
+                os.remove(self._spool('done', name))
+                self._outstanding.pop(name, None)
+                done.append(task)
+
+        self._maintain_workers()
+        return done
+
+    def drm_statuses(self, tasks):
+        """
+        :returns: (dict) task.drm_jobID -> drm_status
+        """
+        if not tasks:
+            return {}
+        spool_dir = self.spool_dir or opj(tasks[0].execution.output_dir, '.cosmos', 'pool')
+        if not os.path.exists(spool_dir):
+            return {}
+        pending = set(os.listdir(opj(spool_dir, 'pending')))
+        running = {r.rpartition('@')[0] for r in os.listdir(opj(spool_dir, 'running'))}
+
+        def f(task):
+            name = self._job_name(task)
+            if name in pending:
+                return 'pending'
+            elif name in running:
+                return 'running'
+            return ''
+
+        return {task.drm_jobID: f(task) for task in tasks}
+
+    def kill(self, task):
+        "Terminates a task"
+        name = self._job_name(task)
+        try:
+            os.remove(self._spool('pending', name))
+        except OSError:
+            # a worker already claimed it
+            open(self._spool('kill', name), 'w').close()
+        self._outstanding.pop(name, None)
+
+    def shutdown(self):
+        # so idle workers exit now, rather than after idle_timeout
+        if self.spool_dir is not None:
+            open(self._spool('shutdown'), 'w').close()
+
+    def kill_tasks(self, tasks, wait=True):
+        if self.spool_dir is None:
+            return
+        for t in tasks:
+            self.kill(t)
+
+        if not self._outstanding:
+            open(self._spool('shutdown'), 'w').close()
+            # give workers a moment to act on the kill requests before killing the workers themselves
+            for _ in range(25):
+                if not os.listdir(self._spool('running')):
+                    break
+                time.sleep(.2)
+            self.jobmanager.drms[self.backend].kill_tasks(self.workers)
+            self.workers = []
@@ -0,0 +1,87 @@
+#!/usr/bin/env python
+"""
+A long lived worker of a :class:`~cosmos.job.pool.DRM_Pool`.  Pulls task command scripts from a spool directory,
+runs them one at a time, and reports their exit status back through the spool.
+
+This is run as a standalone script, and deliberately does not import cosmos, so workers start quickly and only need the
+standard library.
+
+usage: pool_worker.py spool_dir worker_id idle_timeout
+"""
+import os
+import sys
+import json
+import time
+import signal
+import subprocess as sp
+
+opj = os.path.join
+
+
+def write_atomic(spool_dir, path, obj):
+    """write json to a temporary file first, so readers never see a partially written file"""
+    tmp = opj(spool_dir, 'tmp', '%s.%s' % (os.path.basename(path), os.getpid()))
+    with open(tmp, 'w') as fh:
+        json.dump(obj, fh)
+    os.rename(tmp, path)
+
+
+def claim(spool_dir, worker_id):
+    """
+    :returns: (name, running_path) of a job this worker now owns, or None if there are no pending jobs.
+    """
+    for name in sorted(os.listdir(opj(spool_dir, 'pending'))):
+        running_path = opj(spool_dir, 'running', '%s@%s' % (name, worker_id))
+        try:
+            # rename is atomic, so only one worker can win a job
+            os.rename(opj(spool_dir, 'pending', name), running_path)
+        except OSError:
+            continue
+        return name, running_path
+    return None
+
+
+def run(spool_dir, name, running_path):
+    with open(running_path) as fh:
+        job = json.load(fh)
+
+    started = time.time()
+    p = sp.Popen(job['command'], shell=True,
+                 stdout=open(job['stdout'], 'w'),
+                 stderr=open(job['stderr'], 'w'),
+                 preexec_fn=os.setpgrp)
+    kill_path = opj(spool_dir, 'kill', name)
+    while p.poll() is None:
+        if os.path.exists(kill_path):
+            try:
+                os.killpg(p.pid, signal.SIGKILL)
+            except OSError:
+                pass
+            p.wait()
+            os.remove(kill_path)
+            break
+        time.sleep(.2)
+
+    write_atomic(spool_dir, opj(spool_dir, 'done', name),
+                 dict(exit_status=p.returncode, started=started, finished=time.time()))
+    os.remove(running_path)
+
+
+def main(spool_dir, worker_id, idle_timeout):
+    idle_since = time.time()
+    interval = .1
+    while not os.path.exists(opj(spool_dir, 'shutdown')):
+        job = claim(spool_dir, worker_id)
+        if job:
+            run(spool_dir, *job)
+            idle_since = time.time()
+            interval = .1
+        elif time.time() - idle_since > idle_timeout:
+            break
+        else:
+            time.sleep(interval)
+            interval = min(interval * 2, 2)
+
+
+if __name__ == '__main__':
+    main(sys.argv[1], sys.argv[2], float(sys.argv[3]))
@@ -0,0 +1,231 @@
+#!/usr/bin/env python
+"""
+Runs a task's command script and records its resource usage in a profile with the fields of
+:attr:`cosmos.models.Task.Task.profile_fields`.  This is what the command wrapper runs instead of psprofile.
+
+Totals (cpu time, context switches, peak memory and io) come from the rusage that os.wait4 returns when the command
+exits, which costs nothing while the command runs.  Averages, and peaks summed over the whole process tree, come from
+sampling /proc.  Samples are dense at first and back off as the command keeps running, and sampling never uses more
+than `budget` of one core, so short commands pay almost nothing.
+
+The samples can also be saved as a time series, see :func:`write_series`.
+
+This is run as a standalone script, and deliberately does not import cosmos, so it starts quickly and only needs the
+standard library.
+
+usage: profiler.py [--skip_profile] [--budget BUDGET] [--series resources.bin] -o profile.json command_script
+"""
+import os
+import sys
+import json
+import time
+import mmap
+import array
+import struct
+import select
+import argparse
+import threading
+import subprocess as sp
+
+opj = os.path.join
+
+DEFAULT_BUDGET = .01  # fraction of one core that sampling may use
+FIRST_INTERVAL = .1  # commands that finish sooner are never sampled
+MAX_INTERVAL = 30
+BACKOFF = .05  # the sampling interval grows to this fraction of the command's run time so far
+
+PAGE_KB = os.sysconf('SC_PAGE_SIZE') / 1024 if hasattr(os, 'sysconf') else 4
+CLK_TCK = os.sysconf('SC_CLK_TCK') if hasattr(os, 'sysconf') else 100
+
+# A series file is a header, then each column's values one column after another, little endian.  Every column is 4
+# bytes wide, so column i starts at byte SERIES_HEADER.size + i * 4 * n_samples, ex. for numpy.memmap.
+SERIES_MAGIC = 'CRSS'
+SERIES_VERSION = 1
+SERIES_HEADER = struct.Struct('<4sHHI')  # magic, version, number of columns, number of samples
+SERIES_COLUMNS = [('time', 'f'),  # seconds since the command started
+                  ('rss_kb', 'I'),
+                  ('cpu_percent', 'f'),  # since the previous sample
+                  ('io_read_kb', 'I'),  # cumulative
+                  ('io_write_kb', 'I'),  # cumulative
+                  ('num_threads', 'I')]
+
+
+def read(path):
+    with open(path) as fh:
+        return fh.read()
+
+
+def descendants(pid):
+    """
+    :returns: (list) `pid` and the pids of all of its descendants
+    """
+    pids = [pid]
+    for p in pids:
+        try:
+            for tid in os.listdir('/proc/%s/task' % p):
+                pids.extend(int(c) for c in read('/proc/%s/task/%s/children' % (p, tid)).split())
+        except (IOError, OSError):
+            # exited, or a kernel without /proc/pid/task/tid/children
+            pass
+    return pids
+
+
+def sample(pids, io, ticks):
+    """
+    :param dict io: pid -> the process' latest io counters, updated in place
+    :param dict ticks: pid -> the process' latest user + system cpu time in clock ticks, updated in place
+    :returns: (dict) memory, thread and file descriptor usage summed over `pids`
+    """
+    s = dict(rss_mem_kb=0, vms_mem_kb=0, num_threads=0, num_fds=0)
+    for pid in pids:
+        try:
+            # fields after the command name, which may contain spaces
+            stat = read('/proc/%s/stat' % pid).rpartition(')')[2].split()
+            ticks[pid] = int(stat[11]) + int(stat[12])
+            s['num_threads'] += int(stat[17])
+            s['vms_mem_kb'] += int(stat[20]) / 1024
+            s['rss_mem_kb'] += int(stat[21]) * PAGE_KB
+            s['num_fds'] += len(os.listdir('/proc/%s/fd' % pid))
+            io[pid] = dict(l.split(': ') for l in read('/proc/%s/io' % pid).strip().split('\n'))
+        except (IOError, OSError, IndexError, ValueError):
+            # the process exited while it was being sampled
+            pass
+    return s
+
+
+def series_row(elapsed, s, io, ticks, last):
+    """
+    :param dict last: the cumulative cpu time at the previous row, updated in place
+    :returns: (tuple) a row of SERIES_COLUMNS
+    """
+    cpu_seconds = float(sum(ticks.values())) / CLK_TCK
+    interval = elapsed - last.get('time', 0)
+    cpu_percent = 100 * (cpu_seconds - last.get('cpu_seconds', 0)) / interval if interval > 0 else 0
+    last.update(time=elapsed, cpu_seconds=cpu_seconds)
+    return (elapsed, s['rss_mem_kb'], cpu_percent,
+            sum(int(c.get('read_bytes', 0)) for c in io.values()) / 1024,
+            sum(int(c.get('write_bytes', 0)) for c in io.values()) / 1024,
+            s['num_threads'])
+
+
+def write_series(path, rows):
+    """
+    Writes rows of SERIES_COLUMNS column by column.
+    """
+    tmp = '%s.%s.tmp' % (path, os.getpid())
+    with open(tmp, 'wb') as fh:
+        fh.write(SERIES_HEADER.pack(SERIES_MAGIC, SERIES_VERSION, len(SERIES_COLUMNS), len(rows)))
+        for i, (name, typecode) in enumerate(SERIES_COLUMNS):
+            fh.write(struct.pack('<%s%s' % (len(rows), typecode), *[row[i] for row in rows]))
+    os.rename(tmp, path)
+
+
+def read_series(path, columns=None):
+    """
+    Memory maps a series file and reads just the `columns` asked for.
+
+    :param list columns: names of SERIES_COLUMNS, defaults to all of them.
+    :returns: (dict) column name -> array.array
+    """
+    names = [name for name, _ in SERIES_COLUMNS]
+    with open(path, 'rb') as fh:
+        mm = mmap.mmap(fh.fileno(), 0, access=mmap.ACCESS_READ)
+        try:
+            magic, version, n_columns, n = SERIES_HEADER.unpack_from(mm)
+            assert magic == SERIES_MAGIC, '%s is not a resource series' % path
+            series = dict()
+            for name in columns or names:
+                i = names.index(name)
+                typecode = SERIES_COLUMNS[i][1]
+                offset = SERIES_HEADER.size + i * 4 * n
+                series[name] = array.array(typecode, struct.unpack_from('<%s%s' % (n, typecode), mm, offset))
+            return series
+        finally:
+            mm.close()
+
+
+def summarize(samples, io):
+    profile = dict()
+    for field in ['rss_mem_kb', 'vms_mem_kb', 'num_threads', 'num_fds']:
+        values = [s[field] for s in samples]
+        profile['avg_' + field] = int(round(float(sum(values)) / len(values))) if values else None
+        profile['max_' + field] = max(values) if values else None
+    if io:
+        profile['io_read_count'] = sum(int(c.get('syscr', 0)) for c in io.values())
+        profile['io_write_count'] = sum(int(c.get('syscw', 0)) for c in io.values())
+    else:
+        profile['io_read_count'] = profile['io_write_count'] = None
+    return profile
+
+
+def main(command_script, output_path, skip_profile=False, budget=DEFAULT_BUDGET, series_path=None):
+    start = time.time()
+    p = sp.Popen([command_script])
+
+    waited = dict()
+    # written to once the command exits, which wakes the sampling loop.  Event.wait(timeout) would poll every few
+    # milliseconds on python 2.
+    exited, exited_w = os.pipe()
+
+    def wait():
+        waited['pid'], waited['status'], waited['rusage'] = os.wait4(p.pid, 0)
+        os.write(exited_w, b'x')
+
+    waiter = threading.Thread(target=wait)
+    waiter.daemon = True
+    waiter.start()
+
+    samples, io, ticks, rows, last = [], dict(), dict(), [], dict()
+    interval = FIRST_INTERVAL
+    while not select.select([exited], [], [], interval)[0]:
+        if skip_profile:
+            interval = MAX_INTERVAL
+            continue
+        sample_start = time.time()
+        s = sample(descendants(p.pid), io, ticks)
+        samples.append(s)
+        if series_path:
+            rows.append(series_row(sample_start - start, s, io, ticks, last))
+        cost = time.time() - sample_start
+        interval = min(max(FIRST_INTERVAL, (time.time() - start) * BACKOFF, cost / budget), MAX_INTERVAL)
+
+    wall_time = time.time() - start
+    status, ru = waited['status'], waited['rusage']
+    exit_status = os.WEXITSTATUS(status) if os.WIFEXITED(status) else 128 + os.WTERMSIG(status)
+
+    profile = dict(exit_status=exit_status, wall_time=int(round(wall_time)))
+    if not skip_profile:
+        cpu_time = ru.ru_utime + ru.ru_stime
+        profile.update(summarize(samples, io))
+        profile.update(user_time=int(round(ru.ru_utime)),
+                       system_time=int(round(ru.ru_stime)),
+                       cpu_time=int(round(cpu_time)),
+                       percent_cpu=int(round(100 * cpu_time / wall_time)) if wall_time else 0,
+                       ctx_switch_voluntary=ru.ru_nvcsw,
+                       ctx_switch_involuntary=ru.ru_nivcsw,
+                       # rusage counts 512 byte blocks
+                       io_read_kb=ru.ru_inblock / 2,
+                       io_write_kb=ru.ru_oublock / 2,
+                       # ru_maxrss is the peak of the largest single process, the samples are summed over all of them
+                       max_rss_mem_kb=max(ru.ru_maxrss, profile['max_rss_mem_kb'] or 0))
+
+    if series_path and not skip_profile:
+        write_series(series_path, rows)
+
+    tmp = '%s.%s.tmp' % (output_path, os.getpid())
+    with open(tmp, 'w') as fh:
+        json.dump(profile, fh)
+    os.rename(tmp, output_path)
+    return exit_status
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Run a command script and profile its resource usage')
+    parser.add_argument('command_script')
+    parser.add_argument('-o', '--output_path', required=True)
+    parser.add_argument('--skip_profile', action='store_true', help='only record the exit_status and wall_time')
+    parser.add_argument('--budget', type=float, default=DEFAULT_BUDGET,
+                        help='fraction of one core that sampling may use, default %s' % DEFAULT_BUDGET)
+    parser.add_argument('--series', dest='series_path', help='also save the samples as a time series to this path')
+    args = parser.parse_args()
+    sys.exit(main(args.command_script, args.output_path, args.skip_profile, args.budget, args.series_path))
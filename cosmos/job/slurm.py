@@ -0,0 +1,239 @@
+import subprocess as sp
+import getpass
+import tempfile
+import os
+import itertools as it
+
+from .drm import DRM, call_batched
+from ..util.iterstuff import chunked
+from ..util.helpers import mkdir
+
+opj = os.path.join
+
+# job states that mean the job is no longer queued or running
+# https://slurm.schedmd.com/squeue.html#SECTION_JOB-STATE-CODES
+FINISHED_STATES = ['BOOT_FAIL', 'CANCELLED', 'COMPLETED', 'DEADLINE', 'FAILED', 'NODE_FAIL', 'OUT_OF_MEMORY',
+                   'PREEMPTED', 'TIMEOUT']
+
+# job states that mean the job died because of the cluster, rather than the task
+LOST_STATES = ['BOOT_FAIL', 'NODE_FAIL', 'PREEMPTED']
+
+MAX_ARRAY_SIZE = 1000  # slurm's default MaxArraySize is 1001
+MAX_IDS_PER_CALL = 500  # keep command lines short
+
+
+class DRM_SLURM(DRM):
+    name = 'slurm'
+    supports_dependencies = True
+    poll_interval = 60
+
+    def __init__(self, jobmanager, array_jobs=True):
+        """
+        :param bool array_jobs: Submit tasks that become ready together, and have the same native specification, as
+            a single array job.
+        """
+        self.jobmanager = jobmanager
+        self.array_jobs = array_jobs
+
+    def submit_job(self, task):
+        task.drm_jobID = self.submit_command(self.jobmanager.get_command_str(task), task.output_stdout_path,
+                                             task.output_stderr_path, self.native_specification(task))
+
+    @classmethod
+    def get_submit_args(cls, task, default_queue=None):
+        # tasks with the same arguments can be submitted together as an array job, so only name the job by stage
+        jobname = task.stage.name
+        time = ' -t {0}'.format(task.time_req) if task.time_req else ''
+        mem = ' --mem={0}'.format(task.mem_req) if task.mem_req else ''
+        partition = ' -p %s' % default_queue if default_queue else ''
+        return '-N 1 -c {task.cpu_req}{time}{mem}{partition} -J "{jobname}"'.format(**locals())
+
+    def dependency_specification(self, job_ids):
+        return '--dependency=afterok:%s' % ':'.join(map(str, job_ids))
+
+    def submit_command(self, command, stdout_path, stderr_path, native_specification=None):
+        ns = ' ' + native_specification if native_specification else ''
+        sbatch = 'sbatch --parsable -o {stdout} -e {stderr}{ns} '.format(stdout=stdout_path,
+                                                                         stderr=stderr_path,
+                                                                         ns=ns)
+
+        out = sp.check_output('{sbatch} --wrap "{cmd_str}"'.format(cmd_str=command, sbatch=sbatch),
+                              env=os.environ,
+                              preexec_fn=preexec_function,
+                              shell=True)
+        return parse_sbatch(out)
+
+    def submit_jobs(self, tasks):
+        if not self.array_jobs:
+            return super(DRM_SLURM, self).submit_jobs(tasks)
+
+        f = self.native_specification
+        for ns, group in it.groupby(sorted(tasks, key=f), f):
+            for chunk in chunked(list(group), MAX_ARRAY_SIZE):
+                if len(chunk) == 1:
+                    self.submit_job(chunk[0])
+                else:
+                    self._submit_array(chunk, ns)
+
+    def _submit_array(self, tasks, native_specification):
+        """
+        Submits `tasks` as one array job.  Each element of the array runs the task at its index, and its drm_jobID
+        is `arrayjobid_index`.
+        """
+        script_dir = opj(tasks[0].execution.output_dir, '.cosmos', 'slurm')
+        mkdir(script_dir)
+        fd, script_path = tempfile.mkstemp(prefix='array_', suffix='.sh', dir=script_dir)
+        with os.fdopen(fd, 'w') as fh:
+            fh.write('#!/bin/bash\n'
+                     'case $SLURM_ARRAY_TASK_ID in\n')
+            for i, task in enumerate(tasks):
+                fh.write('{i}) exec > "{stdout}" 2> "{stderr}"; {cmd_str};;\n'.format(
+                    i=i, stdout=task.output_stdout_path, stderr=task.output_stderr_path,
+                    cmd_str=self.jobmanager.get_command_str(task)))
+            fh.write('esac\n')
+
+        ns = ' ' + native_specification if native_specification else ''
+        out = sp.check_output('sbatch --parsable --array=0-{n} -o /dev/null -e {log}{ns} {script}'.format(
+            n=len(tasks) - 1, log=script_path + '.%a.stderr.txt', ns=ns, script=script_path),
+            env=os.environ,
+            preexec_fn=preexec_function,
+            shell=True)
+        array_job_id = parse_sbatch(out)
+        for i, task in enumerate(tasks):
+            task.drm_jobID = '%s_%s' % (array_job_id, i)
+
+    def filter_is_done(self, tasks):
+        if len(tasks):
+            states = job_states(tasks)
+
+            def f(task):
+                state = states.get(str(task.drm_jobID))
+                # jobs unknown to both squeue and sacct are gone
+                return state is None or state in FINISHED_STATES
+
+            return filter(f, tasks)
+        else:
+            return []
+
+    def accounting(self, tasks):
+        info = dict()
+        for group in chunked(tasks, MAX_IDS_PER_CALL):
+            jobs = sacct_exit_info([str(t.drm_jobID) for t in group])
+            info.update((t, jobs[str(t.drm_jobID)]) for t in group if str(t.drm_jobID) in jobs)
+        return info
+
+    def drm_statuses(self, tasks):
+        """
+        :param tasks: tasks that have been submitted to the job manager
+        :returns: (dict) task.drm_jobID -> drm_status
+        """
+        if len(tasks):
+            states = job_states(tasks)
+            return {task.drm_jobID: states.get(str(task.drm_jobID), '???') for task in tasks}
+        else:
+            return {}
+
+    def kill(self, task):
+        "Terminates a task"
+        self.kill_tasks([task])
+
+    def kill_tasks(self, tasks, wait=True):
+        "Terminates tasks with batched, parallel scancel calls, and waits for slurm to confirm they have exited"
+        call_batched(lambda ids: ['scancel'] + ids, [t.drm_jobID for t in tasks], batch_size=MAX_IDS_PER_CALL,
+                     preexec_fn=preexec_function)
+        if wait:
+            self.wait_until_done(tasks)
+
+
+def parse_sbatch(out):
+    """sbatch --parsable prints `jobid` or `jobid;cluster`"""
+    return out.strip().split(';')[0]
+
+
+def job_states(tasks):
+    """
+    Queries squeue once for the user's queued and running jobs, then sacct, in batches, for any of `tasks` that
+    squeue no longer knows about.
+
+    :returns: (dict) job id -> job state
+    """
+    states = squeue_all()
+    missing = [str(t.drm_jobID) for t in tasks if str(t.drm_jobID) not in states]
+    for group in chunked(missing, MAX_IDS_PER_CALL):
+        states.update(sacct(group))
+    return states
+
+
+def squeue_all():
+    """
+    :returns: (dict) job id -> state, for all of this user's jobs.  Array jobs are expanded into their elements.
+    """
+    try:
+        out = sp.check_output(['squeue', '-h', '-r', '-u', getpass.getuser(), '-o', '%i %T'],
+                              preexec_fn=preexec_function)
+    except (sp.CalledProcessError, OSError):
+        return {}
+    return dict(l.split()[:2] for l in out.strip().split('\n') if l.strip())
+
+
+def sacct(job_ids):
+    """
+    :returns: (dict) job id -> state, for the jobs in `job_ids` that slurm's accounting knows about
+    """
+    try:
+        out = sp.check_output(['sacct', '-n', '-P', '-X', '-o', 'JobID,State', '-j', ','.join(job_ids)],
+                              preexec_fn=preexec_function)
+    except (sp.CalledProcessError, OSError):
+        return {}
+    states = dict()
+    for l in out.strip().split('\n'):
+        if '|' in l:
+            job_id, state = l.split('|')[:2]
+            # ex. "CANCELLED by 1234"
+            states[job_id] = state.split(' ')[0]
+    return states
+
+
+def sacct_exit_info(job_ids):
+    """
+    :returns: (dict) job id -> dict(exit_status, lost, reason, wall_time, cpu_time), for the jobs in `job_ids` that
+        slurm's accounting knows about.  MaxRSS is only reported for job steps, so it is not included.
+    """
+    try:
+        out = sp.check_output(['sacct', '-n', '-P', '-X', '-o', 'JobID,State,ExitCode,Elapsed,TotalCPU',
+                               '-j', ','.join(job_ids)],
+                              preexec_fn=preexec_function)
+    except (sp.CalledProcessError, OSError):
+        return {}
+    jobs = dict()
+    for l in out.strip().split('\n'):
+        if l.count('|') >= 4:
+            job_id, state, exit_code, elapsed, total_cpu = l.split('|')[:5]
+            state = state.split(' ')[0]
+            # ExitCode is `exit_code:signal`
+            code, _, sig = exit_code.partition(':')
+            exit_status = 128 + int(sig) if sig and int(sig) else int(code)
+            jobs[job_id] = dict(exit_status=exit_status, lost=state in LOST_STATES, reason=state,
+                                wall_time=parse_duration(elapsed), cpu_time=parse_duration(total_cpu))
+    return jobs
+
+
+def parse_duration(s):
+    """
+    :param str s: [days-][hours:]minutes:seconds[.fraction], ex. '1-02:03:04' or '03:04.567'
+    :returns: (int) seconds
+    """
+    if not s:
+        return None
+    days, _, s = s.rpartition('-')
+    seconds = 0
+    for part in s.split(':'):
+        seconds = seconds * 60 + float(part)
+    return int(round(seconds + int(days or 0) * 86400))
+
+
+def preexec_function():
+    # Ignore the SIGINT signal by setting the handler to the standard
+    # signal handler SIG_IGN.  This allows Cosmos to cleanly
+    # terminate jobs when there is a ctrl+c event
+    os.setpgrp()
@@ -4,8 +4,8 @@ import shutil
 from sqlalchemy.ext.declarative import declared_attr
 from sqlalchemy.schema import Column
 from sqlalchemy.types import Boolean, Integer, String, DateTime, VARCHAR
-from sqlalchemy import orm
-from sqlalchemy.sql.expression import func
+from sqlalchemy import orm, inspect
+from sqlalchemy.sql.expression import func, select
 from sqlalchemy.orm import validates, synonym, relationship, backref
 from flask import url_for
 import networkx as nx
@@ -14,19 +14,22 @@ import atexit
 from ..util.iterstuff import only_one
 import sys
 
-from ..util.helpers import duplicates, groupby2
+from ..util.helpers import duplicates
 from ..db import Base
 import time
 import itertools as it
 import datetime
+from collections import Counter, defaultdict
 
 opj = os.path.join
 import signal
 
 from .. import TaskStatus, StageStatus, Task, ExecutionStatus, signal_execution_status_change
+from .Task import tags_hash, index_task_tags, filter_by_tags, count_by_tag
 
 from ..util.helpers import get_logger
-from ..util.sqla import Enum34_ColumnType, MutableDict, JSONEncodedDict, get_or_create
+from ..util.sqla import Enum34_ColumnType, MutableDict, JSONEncodedDict, get_or_create, allocate_ids, \
+    insert_values, bulk_insert, forget_changes, mark_persisted, set_loaded
 
 
 def _default_task_log_output_dir(task):
@@ -35,7 +38,7 @@ def _default_task_log_output_dir(task):
 
 
 def get_or_create_task(tool, successful_tasks, tags, stage, parents, default_drm):
-    existing_task = successful_tasks.get(frozenset(tags.items()), None)
+    existing_task = successful_tasks.get(tags_hash(tags), None)
     if existing_task:
         existing_task.tool = tool
         return existing_task
@@ -115,6 +118,7 @@ class Execution(Base):
             self.info = dict()
         self.jobmanager = None
         self.created_on = datetime.datetime.now()
+        self._task_index = dict()  # Stage -> Execution._tasks_by_tags()
 
     def __getattr__(self, item):
         if item == 'log':
@@ -149,9 +153,11 @@ class Execution(Base):
         if name is None:
             name = tools[0].__class__.__name__
 
-        for tags, tool_group in groupby2(tools, lambda tool: tool.tags):
-            tool_group = list(tool_group)
-            if len(tool_group) > 1:
+        hashes = [tags_hash(tool.tags) for tool in tools]
+        for h, n in Counter(hashes).items():
+            if n > 1:
+                tool_group = [tool for tool, h2 in zip(tools, hashes) if h2 == h]
+                tags = tool_group[0].tags
                 s = 'Duplicate tags detected: {tags}.  \n' \
                     'In tasks: {tool_group}  \n' \
                     'Tags within a stage must be unique.'.format(**locals())
@@ -161,31 +167,61 @@ class Execution(Base):
 
 
         # stage, created = get_or_create(session=self.session, model=Stage, execution=self, name=name)
-        try:
-            stage = only_one(s for s in self.stages if s.name == name)
-        except ValueError:
-            stage = Stage(execution=self, name=name)
-        self.session.add(stage)
-
-        # successful because failed jobs have been deleted.
-        successful_tasks = {frozenset(t.tags.items()): t for t in stage.tasks}
-
-        new_parent_stages = set()
-        new_tasks = list()
-        for tool in tools:
-            new_parent_stages = new_parent_stages.union(p.stage for p in tool.task_parents)
-            task = get_or_create_task(tool, successful_tasks, tool.tags, stage, parents=tool.task_parents,
-                                      default_drm=self.cosmos_app.default_drm)
-            tool.task = task
-            new_tasks.append(task)
-        stage.parents += list(new_parent_stages.difference(stage.parents))
+        # new tasks are inserted in bulk by run(), so loading stages and tasks must not flush them
+        with self.session.no_autoflush:
+            try:
+                stage = only_one(s for s in self.stages if s.name == name)
+            except ValueError:
+                stage = Stage(execution=self, name=name)
+            self.session.add(stage)
+
+            # successful because failed jobs have been deleted.
+            successful_tasks = self._tasks_by_tags(stage, hashes)
+
+            new_parent_stages = set()
+            new_tasks = list()
+            for tool, h in zip(tools, hashes):
+                new_parent_stages = new_parent_stages.union(p.stage for p in tool.task_parents)
+                task = get_or_create_task(tool, successful_tasks, tool.tags, stage, parents=tool.task_parents,
+                                          default_drm=self.cosmos_app.default_drm)
+                successful_tasks[h] = task
+                tool.task = task
+                new_tasks.append(task)
+            stage.parents += list(new_parent_stages.difference(stage.parents))
 
         #todo temporary
         for t in new_tasks:
             assert hasattr(t, 'tool')
+        # the session only holds weak references to committed tasks, and a task's tool is not persisted, so keep the
+        # new tasks alive until run() has them
+        if not hasattr(self, '_added_tasks'):
+            self._added_tasks = []
+        self._added_tasks.extend(new_tasks)
+        self._task_graph = None
         return new_tasks
 
-    def run(self, log_output_dir=_default_task_log_output_dir, dry=False, set_successful=True):
+    def _tasks_by_tags(self, stage, hashes):
+        """
+        :param hashes: (list) tags_hash of each task to look up.
+        :returns: (dict) tags_hash -> Task of stage's tasks, with those in `hashes` that exist loaded.  They are
+            looked up with the stage's unique (stage_id, tags_hash) index, rather than by loading all of its tasks,
+            and the dict is kept for later calls, so it must be updated with the tasks they create.
+        """
+        index = self._task_index.setdefault(stage, dict())
+        for h in hashes:
+            task = index.get(h)
+            if task is not None and task not in self.session:
+                # deleted since it was loaded
+                del index[h]
+        if inspect(stage).has_identity:
+            missing = list(set(h for h in hashes if h not in index))
+            for i in range(0, len(missing), 500):
+                for task in self.session.query(Task).filter(Task.stage_id == stage.id,
+                                                            Task.tags_hash.in_(missing[i:i + 500])):
+                    index[task.tags_hash] = task
+        return index
+
+    def run(self, log_output_dir=_default_task_log_output_dir, dry=False, set_successful=True, drm_dependencies=False):
         """
         Renders and executes the :param:`recipe`
 
@@ -196,6 +232,9 @@ class Execution(Base):
         :param dry: (bool) if True, do not actually run any jobs.
         :param set_successful: (bool) sets this execution as successful if all rendered recipe executes without a failure.  You might set this to False if you intend to add and
             run more tasks in this execution later.
+        :param drm_dependencies: (bool) Submit tasks before their parents have finished, and let DRMs that support it
+            (lsf and slurm) hold them until their parents succeed.  Children then start as soon as their parents
+            finish, rather than after Cosmos notices.
 
         """
         assert os.path.exists(os.getcwd()), 'current working dir does not exist! %s' % os.getcwd()
@@ -209,7 +248,19 @@ class Execution(Base):
         from ..job.JobManager import JobManager
 
         self.jobmanager = JobManager(get_submit_args=self.cosmos_app.get_submit_args,
-                                     default_queue=self.cosmos_app.default_queue)
+                                     default_queue=self.cosmos_app.default_queue,
+                                     drm_options=self.cosmos_app.drm_options,
+                                     max_cpus=self.max_cpus)
+
+        # rebuild the task graph from the database, ex. if another process changed it
+        self._task_graph = None
+
+        # insert new tasks before anything commits the session, which would insert them one at a time
+        with self.jobmanager.timings.span('bulk_insert'):
+            _bulk_insert_tasks(session, [t for t in self.tasks if not inspect(t).has_identity])
+        if self.cosmos_app.index_tags:
+            with self.jobmanager.timings.span('index_tags'):
+                index_task_tags(session, self._tasks_where())
 
         self.status = ExecutionStatus.running
         self.successful = False
@@ -222,7 +273,10 @@ class Execution(Base):
         # import ipdb
         # with ipdb.launch_ipdb_on_exception():
         #     print self.tasks
-        task_g = self.task_graph()
+        with self.jobmanager.timings.span('task_graph'):
+            task_g = self.task_graph()
+        # the new tasks have been inserted, and task_g keeps them alive from here on
+        self._added_tasks = []
         stage_g = self.stage_graph()
 
         # Set output_dirs of new tasks
@@ -294,7 +348,10 @@ class Execution(Base):
 
         # commit so task.id is set for log dir
         self.log.info('Committing %s Tasks to the SQL database...' % (len(task_g.nodes()) - len(successful)))
-        session.commit()
+        _commit(self)
+        # the commit expired every task, so reload them together rather than each on its next access
+        with self.jobmanager.timings.span('reload_tasks'):
+            _load_task_graph(session, self)
 
         # print stages
         for s in topological_sort(stage_g):
@@ -339,7 +396,7 @@ class Execution(Base):
 
         # Run this thing!
         if not dry:
-            _run(self, session, task_queue)
+            _run(self, session, task_queue, drm_dependencies)
 
             # set status
             if self.status == ExecutionStatus.failed_but_running:
@@ -388,6 +445,25 @@ class Execution(Base):
         return [t for s in self.stages for t in s.tasks]
         # return session.query(Task).join(Stage).filter(Stage.execution == ex).all()
 
+    def _tasks_where(self):
+        """:returns: criteria on Task selecting this execution's tasks"""
+        from .Stage import Stage
+
+        return Task.stage_id.in_(select([Stage.id]).where(Stage.execution_id == self.id))
+
+    def query_tasks(self, **tags):
+        """
+        :returns: a query of this execution's tasks that have all of `tags`, with values compared as strings, ex.
+            `ex.query_tasks(sample='A').count()`.  Tags are only indexed if the Cosmos was created with index_tags=True.
+        """
+        return filter_by_tags(self.session.query(Task).filter(self._tasks_where()), tags)
+
+    def num_tasks_by_tag(self, key, **tags):
+        """
+        :returns: (dict) value of tag `key` -> number of this execution's tasks with it, of those with all of `tags`.
+        """
+        return count_by_tag(self.session, key, self._tasks_where(), tags)
+
     @property
     def taskfilesq(self):
         from . import TaskFile, Stage
@@ -405,12 +481,16 @@ class Execution(Base):
 
     def task_graph(self):
         """
-        :return: (networkx.DiGraph) a DAG of the tasks
+        :return: (networkx.DiGraph) a DAG of the tasks.  It is built once, and rebuilt after tasks are added or deleted,
+            or the execution is run, so it should not be modified.
         """
-        g = nx.DiGraph()
-        g.add_nodes_from(self.tasks)
-        g.add_edges_from([(t, c) for t in self.tasks for c in t.children])
-        return g
+        if getattr(self, '_task_graph', None) is None:
+            tasks, edges = _load_task_graph(self.session, self)
+            g = nx.DiGraph()
+            g.add_nodes_from(tasks)
+            g.add_edges_from(edges)
+            self._task_graph = g
+        return self._task_graph
 
 
     def get_stage(self, name_or_id):
@@ -454,21 +534,17 @@ class Execution(Base):
         if delete_files and os.path.exists(self.output_dir):
             shutil.rmtree(self.output_dir)
 
-        ### Faster deleting can be done with explicit sql queries
-        # from .TaskFile import InputFileAssociation
-        # from .Task import TaskEdge
-        # from .. import Stage, TaskFile
-        # self.session.query(InputFileAssociation).join(Task).join(Stage).join(Execution).filter(Execution.id == self.id).delete()
-        # self.session.query(TaskFile).join(Task).join(Stage).join(Execution).filter(Execution.id == self.id).delete()
-        #
-        # self.session.query(TaskEdge).join(Stage).join(Execution).filter(Execution.id == self.id).delete()
-        # self.session.query(Task).join(Stage).join(Execution).filter(Execution.id == self.id).delete()
-        # self.session.query(Stage).join(Execution).filter(Execution.id == self.id).delete()
-        #
+        # explicit sql queries are much faster than the ORM's cascades
+        from .Stage import Stage, delete_stages
+
         print >> sys.stderr, 'Deleting from SQL...'
-        self.session.delete(self)
-        self.session.commit()
-        print >> sys.stderr, '%s Deleted' % self
+        name = str(self)
+        session = self.session
+        delete_stages(session, Stage.execution_id == self.id)
+        session.execute(Execution.__table__.delete().where(Execution.id == self.id))
+        session.expunge(self)
+        session.commit()
+        print >> sys.stderr, '%s Deleted' % name
 
         # def yield_outputs(self, name):
         # for task in self.tasks:
@@ -487,19 +563,28 @@ class Execution(Base):
 # def before_delete(mapper, connection, target):
 # print 'before_delete %s ' % target
 
-def _run(execution, session, task_queue):
+def _run(execution, session, task_queue, drm_dependencies=False):
     """
     Do the execution!
     """
+    from ..job.metrics import write_metrics, METRICS_INTERVAL
+
     execution.log.info('Executing TaskGraph')
 
     available_cores = True
+    finished = Counter()  # (stage name, status) -> tasks
+    metrics_written = 0
     while len(task_queue) > 0:
         if available_cores:
-            _run_queued_and_ready_tasks(task_queue, execution)
-            available_cores = False
+            # if tasks were held back, try again on the next loop rather than waiting for a task to finish
+            available_cores = _run_queued_and_ready_tasks(task_queue, execution, drm_dependencies)
 
+        # cancelled once the finished tasks have all been processed, since that changes jobmanager.running_tasks
+        cancel = []
         for task in _process_finished_tasks(execution.jobmanager):
+            if drm_dependencies and task.status in [TaskStatus.failed, TaskStatus.no_attempt]:
+                cancel += _waiting_descendants(task_queue, task, execution)
+
             if task.status == TaskStatus.failed and task.must_succeed:
                 # pop all descendents when a task fails
                 task_queue.remove_nodes_from(descendants(task_queue, task))
@@ -510,36 +595,107 @@ def _run(execution, session, task_queue):
                 # just pop this task
                 task_queue.remove_node(task)
             elif task.status == TaskStatus.no_attempt:
-                # the task must have failed, and is being reattempted
+                # the task must have failed, and is being reattempted, or the DRM lost its job
                 pass
             else:
                 raise AssertionError('Unexpected finished task status %s for %s' % (task.status, task))
+            finished[(task.stage.name, task.status.name)] += 1
             available_cores = True
 
+        if cancel:
+            execution.jobmanager.cancel_tasks(cancel)
+
         # only commit Task changes after processing a batch of finished ones
-        session.commit()
+        _commit(execution)
+
+        if time.time() - metrics_written > METRICS_INTERVAL:
+            write_metrics(execution, task_queue, finished)
+            metrics_written = time.time()
         time.sleep(.3)
 
+    execution.jobmanager.shutdown()
+    # the last tasks' profiles may still be being read in the background
+    execution.jobmanager.apply_profiles(wait=True)
+    execution.jobmanager.read_accounting(force=True)
 
-def _run_queued_and_ready_tasks(task_queue, execution):
+    timings = execution.jobmanager.timings
+    execution.info['timings'] = timings.summary()
+    execution.log.info('Scheduler timings, in seconds:\n%s' % timings.format())
+    write_metrics(execution, task_queue, finished)
+    _commit(execution)
+
+
+def _commit(execution):
+    with execution.jobmanager.timings.span('session.commit'):
+        execution.session.commit()
+
+
+def _run_queued_and_ready_tasks(task_queue, execution, drm_dependencies=False):
+    """
+    :param drm_dependencies: Also submit tasks whose parents have all been submitted to a DRM that can hold them
+        until their parents succeed.  Tasks are submitted in waves until the rest of the queue is waiting on a
+        parent Cosmos has to see finish.
+    :returns: (bool) True if a ready task was held back by its DRM
+    """
+    jobmanager = execution.jobmanager
     max_cpus = execution.max_cpus
+    held_back = False
     ready_tasks = [task for task, degree in task_queue.in_degree().items() if
                    degree == 0 and task.status == TaskStatus.no_attempt]
-    for ready_task in sorted(ready_tasks, key=lambda t: t.cpu_req):
-        cores_used = sum([t.cpu_req for t in execution.jobmanager.running_tasks])
-        if max_cpus is not None and ready_task.cpu_req + cores_used > max_cpus:
-            execution.log.info('Reached max_cpus limit of %s, waiting for a task to finish...' % max_cpus)
+    cores_used = sum([t.cpu_req for t in jobmanager.running_tasks])
+    after = dict()
+    while ready_tasks:
+        submit = []
+        for ready_task in sorted(ready_tasks, key=lambda t: t.cpu_req):
+            if max_cpus is not None and ready_task.cpu_req + cores_used > max_cpus:
+                execution.log.info('Reached max_cpus limit of %s, waiting for a task to finish...' % max_cpus)
+                break
+
+            if not jobmanager.can_submit(ready_task):
+                held_back = True
+                continue
+
+            submit.append(ready_task)
+            cores_used += ready_task.cpu_req
+
+        jobmanager.submit_tasks(submit, after=after)
+        if not drm_dependencies or not submit:
             break
 
-        execution.jobmanager.submit(ready_task)
+        ready_tasks = []
+        after = dict()
+        for task in task_queue.nodes():
+            parents = task_queue.predecessors(task)
+            if task.status == TaskStatus.no_attempt and parents and \
+                    jobmanager.drms[task.drm].supports_dependencies and \
+                    all(p.status == TaskStatus.submitted and not p.NOOP and p.must_succeed and p.drm == task.drm
+                        for p in parents):
+                ready_tasks.append(task)
+                after[task] = parents
 
     # only commit submitted Tasks after submitting a batch
-    execution.session.commit()
+    _commit(execution)
+    return held_back
+
+
+def _waiting_descendants(task_queue, task, execution):
+    """
+    :returns: (list) descendants of `task` that were submitted to wait on it with DRM dependencies, and have to be
+        cancelled since `task` failed, or its job was lost.  They return to the queue, and are resubmitted if `task`
+        is reattempted.
+    """
+    waiting = [t for t in descendants(task_queue, task) if t.status == TaskStatus.submitted]
+    if waiting:
+        execution.log.info('Cancelling %s task(s) that were waiting on %s' % (len(waiting), task))
+    return waiting
 
 
 def _process_finished_tasks(jobmanager):
     for task in jobmanager.get_finished_tasks():
-        if task.NOOP or task.profile.get('exit_status', None) == 0:
+        if task.status == TaskStatus.no_attempt:
+            # the DRM lost its job, so it is back in the queue
+            yield task
+        elif task.NOOP or task.exit_status == 0:
             task.status = TaskStatus.successful
             yield task
         else:
@@ -548,15 +704,26 @@ def _process_finished_tasks(jobmanager):
 
 
 def handle_exits(execution, do_atexit=True):
+    timings = execution.jobmanager.timings
+
     # terminate on ctrl+c
     def ctrl_c(signal, frame):
-        if not execution.successful:
-            execution.log.info('Caught SIGINT (ctrl+c)')
-            execution.terminate(due_to_failure=False)
-            raise SystemExit('Execution terminated with a SIGINT (ctrl+c) event')
+        with timings.span('signal.SIGINT'):
+            if not execution.successful:
+                execution.log.info('Caught SIGINT (ctrl+c)')
+                execution.terminate(due_to_failure=False)
+                raise SystemExit('Execution terminated with a SIGINT (ctrl+c) event')
 
     signal.signal(signal.SIGINT, ctrl_c)
 
+    # `kill -USR1 <pid>` logs what the scheduler has been spending its time on so far
+    def snapshot(signal, frame):
+        with timings.span('signal.SIGUSR1'):
+            execution.log.info('Caught SIGUSR1, %s tasks are running.  Scheduler timings, in seconds:\n%s' % (
+                len(execution.jobmanager.running_tasks), timings.format()))
+
+    signal.signal(signal.SIGUSR1, snapshot)
+
     if atexit:
         @atexit.register
         def cleanup_check():
@@ -566,10 +733,120 @@ def handle_exits(execution, do_atexit=True):
                 # raise SystemExit('Execution terminated due to the python interpreter exiting')
 
 
+def _bulk_insert_tasks(session, tasks):
+    """
+    Inserts new tasks, with their output TaskFiles, TaskEdges and InputFileAssociations, using an executemany per
+    table rather than the unit of work, which inserts them one at a time.  Afterwards the tasks are in the session as
+    if they had been loaded from the database, so later changes to them are flushed as usual.  Only done on SQLite,
+    see :func:`allocate_ids`.  Elsewhere the tasks are left for the unit of work to insert.
+
+    :param list tasks: new Tasks, which have not been flushed yet
+    """
+    from .TaskFile import TaskFile, InputFileAssociation
+    from .Task import TaskEdge
+
+    if not tasks or session.connection().dialect.name != 'sqlite':
+        return
+    new = set(tasks)
+    taskfiles = [tf for t in tasks for tf in t.output_files]
+    ifas = [ifa for t in tasks for ifa in t._input_file_assocs]
+    new.update(taskfiles)
+
+    with session.no_autoflush:
+        # take the new objects out of the session, and forget the changes they made to the objects that remain in it,
+        # so flushing those (new Stages, mostly) does not insert the new objects as well.  Expunging a task cascades to
+        # its output files and input file associations.
+        for task in tasks:
+            if task in session:
+                session.expunge(task)
+        for stage in set(t.stage for t in tasks):
+            forget_changes(stage, 'tasks')
+        for parent in set(p for t in tasks for p in t.parents if p not in new):
+            forget_changes(parent, 'children')
+        for tf in set(ifa.taskfile for ifa in ifas if ifa.taskfile not in new):
+            forget_changes(tf, '_input_file_assocs')
+        session.flush()
+
+        allocate_ids(session, Task, tasks)
+        for task in tasks:
+            task.stage_id = task.stage.id
+        allocate_ids(session, TaskFile, taskfiles)
+        for tf in taskfiles:
+            tf.task_output_for_id = tf.task_output_for.id
+        for ifa in ifas:
+            ifa.task_id = ifa.task.id
+            ifa.taskfile_id = ifa.taskfile.id
+
+        bulk_insert(session, Task.__table__, map(insert_values, tasks))
+        # Task.parents joins a task to the TaskEdges with its id as their parent_id
+        bulk_insert(session, TaskEdge.__table__,
+                    [dict(parent_id=t.id, child_id=p.id) for t in tasks for p in t.parents])
+        bulk_insert(session, TaskFile.__table__, map(insert_values, taskfiles))
+        bulk_insert(session, InputFileAssociation.__table__, map(insert_values, ifas))
+
+        mark_persisted(session, tasks, cascaded=taskfiles + ifas)
+
+
 def _copy_graph(graph):
     import networkx as nx
 
     graph2 = nx.DiGraph()
     graph2.add_edges_from(graph.edges())
     graph2.add_nodes_from(graph.nodes())
-    return graph2
\ No newline at end of file
+    return graph2
+
+
+def _load_task_graph(session, execution):
+    """
+    Loads an execution's tasks, with their TaskEdges, output TaskFiles and InputFileAssociations, using a query per
+    table rather than a lazy load per task, and sets the relationships between them that have not been loaded, as if
+    they had been.  Tasks that have not been inserted yet are included, with their edges from their parents.
+
+    :returns: (list of Tasks, list of (parent, child) Task edges)
+    """
+    from .TaskFile import TaskFile, InputFileAssociation
+    from .Task import TaskEdge
+
+    if not inspect(execution).has_identity:
+        tasks = execution.tasks
+        return tasks, [(p, t) for t in tasks for p in t.parents]
+
+    with session.no_autoflush:
+        stages = execution.stages
+        task_ids = select([Task.id]).where(execution._tasks_where())
+        loaded = session.query(Task).filter(Task.id.in_(task_ids)).all()
+        by_id = {t.id: t for t in loaded}
+        stage_tasks = defaultdict(list)
+        stage_by_id = {stage.id: stage for stage in stages}
+        for task in loaded:
+            stage_tasks[stage_by_id[task.stage_id]].append(task)
+        set_loaded(stages, 'tasks', stage_tasks)
+
+        # Task.parents joins a task to the TaskEdges with its id as their parent_id
+        edges = [(by_id[parent_id], by_id[task_id]) for task_id, parent_id in
+                 session.query(TaskEdge.parent_id, TaskEdge.child_id).filter(TaskEdge.parent_id.in_(task_ids))]
+        parents, children = defaultdict(list), defaultdict(list)
+        for parent, child in edges:
+            parents[child].append(parent)
+            children[parent].append(child)
+        set_loaded(loaded, 'parents', parents)
+        set_loaded(loaded, 'children', children)
+
+        taskfiles = session.query(TaskFile).filter(TaskFile.task_output_for_id.in_(task_ids)).all()
+        taskfile_by_id = {tf.id: tf for tf in taskfiles}
+        output_files = defaultdict(list)
+        for tf in taskfiles:
+            output_files[by_id[tf.task_output_for_id]].append(tf)
+        set_loaded(loaded, 'output_files', output_files)
+
+        # the many-to-one sides are found in the identity map, but looking them up by id is quicker
+        task_ifas, taskfile_ifas = defaultdict(list), defaultdict(list)
+        for ifa in session.query(InputFileAssociation).filter(InputFileAssociation.task_id.in_(task_ids)):
+            task_ifas[by_id[ifa.task_id]].append(ifa)
+            taskfile_ifas[taskfile_by_id[ifa.taskfile_id]].append(ifa)
+        set_loaded(loaded, '_input_file_assocs', task_ifas)
+        set_loaded(taskfiles, '_input_file_assocs', taskfile_ifas)
+
+        tasks = execution.tasks
+        edges += [(p, t) for t in tasks if not inspect(t).has_identity for p in t.parents]
+    return tasks, edges
@@ -3,10 +3,12 @@ from sqlalchemy.schema import Column, ForeignKey, UniqueConstraint
 from sqlalchemy.types import Boolean, Integer, String, DateTime
 from sqlalchemy.orm import relationship, synonym, backref, validates
 from sqlalchemy.ext.declarative import declared_attr
+from sqlalchemy import inspect
+from sqlalchemy.sql.expression import select, or_, and_, exists
 from flask import url_for
 
 from ..db import Base
-from ..util.sqla import Enum34_ColumnType
+from ..util.sqla import Enum34_ColumnType, expunge_deleted
 from .. import StageStatus, signal_stage_status_change, RelationshipType, TaskStatus
 import networkx as nx
 import datetime
@@ -127,19 +129,54 @@ class Stage(Base):
         :param delete_descendants: Also delete all descendants of this stage
         :return: None
         """
+        stages = [self]
         if delete_descendants:
             self.log.info('Deleting all descendants of %s' % self)
-            for stage in reversed(list(self.descendants())):
-                stage.delete(delete_files)
+            stages += list(self.descendants())
+
+        for stage in stages:
+            self.log.info('Deleting %s. delete_files=%s' % (stage, delete_files))
+            if delete_files:
+                for t in stage.tasks:
+                    t.delete_files()
+        session = self.session
+        self.execution._task_graph = None
+        delete_stages(session, Stage.id.in_([stage.id for stage in stages]))
+        session.commit()
+
+    def query_tasks(self, **tags):
+        """
+        :returns: a query of this stage's tasks that have all of `tags`, with values compared as strings, ex.
+            `stage.query_tasks(sample='A').all()`.  Tags are only indexed if the Cosmos was created with
+            index_tags=True.
+        """
+        from .Task import Task, filter_by_tags
+
+        return filter_by_tags(self.session.query(Task).filter(Task.stage_id == self.id), tags)
+
+    def num_tasks_by_tag(self, key, **tags):
+        """
+        :returns: (dict) value of tag `key` -> number of this stage's tasks with it, of those with all of `tags`.
+        """
+        from .Task import Task, count_by_tag
+
+        return count_by_tag(self.session, key, Task.stage_id == self.id, tags)
+
+    def tags_indexed(self):
+        """
+        :returns: (bool) True if all of this stage's tasks are in the task_tag table, so query_tasks() finds every
+            match, rather than just those of the tasks indexed so far.
+        """
+        from .Task import Task
 
-        self.log.info('Deleting %s. delete_files=%s' % (self, delete_files))
-        if delete_files:
-            for t in self.tasks:
-                t.delete(delete_files=True)
-        self.session.delete(self)
-        self.session.commit()
+        if not inspect(self).has_identity:
+            return False
+        return not self.session.query(exists().where(and_(Task.stage_id == self.id,
+                                                          Task.tags_indexed == False))).scalar()
 
     def get_tasks(self, **filter_by):
+        if filter_by and self.tags_indexed():
+            return self.query_tasks(**filter_by).all()
         return [t for t in self.tasks if all(str(t.tags.get(k, None)) == v for k, v in filter_by.items())]
 
     def get_task(self, **filter_by):
@@ -148,6 +185,23 @@ class Stage(Base):
         assert len(tasks) == 1, 'more than one task with tags %s' % filter_by
         return tasks[0]
 
+    def resource_series(self, columns, max_tasks=None):
+        """
+        Streams columns of each task's resource series, reading a single task's series at a time, so many can be
+        overlayed without loading them all into memory.
+
+        :param list columns: ex. ['rss_kb'], see :data:`cosmos.job.profiler.SERIES_COLUMNS`.
+        :param int max_tasks: read at most this many tasks' series, sampled evenly from the stage's tasks.
+        :yields: (task, dict of column name -> values, including 'time')
+        """
+        tasks = self.tasks
+        if max_tasks is not None and len(tasks) > max_tasks:
+            tasks = [tasks[i * len(tasks) // max_tasks] for i in range(max_tasks)]
+        for task in tasks:
+            series = task.resource_series(['time'] + list(columns))
+            if series is not None:
+                yield task, series
+
     def percent_successful(self):
         return round(float(self.num_successful_tasks()) / (float(len(self.tasks)) or 1) * 100, 2)
 
@@ -176,3 +230,20 @@ class Stage(Base):
     def __repr__(self):
         return '<Stage[%s] %s>' % (self.id or '', self.name)
 
+
+def delete_stages(session, where):
+    """
+    Deletes stages, with their tasks and StageEdges, using a DELETE per table in the session's transaction.  See
+    cosmos.models.Task.delete_tasks.
+
+    :param where: criteria on Stage selecting the stages to delete, ex. `Stage.execution_id == 1`
+    """
+    from .Task import Task, delete_tasks
+
+    stage_ids = select([Stage.id]).where(where)
+    delete_tasks(session, Task.stage_id.in_(stage_ids))
+
+    expunge_deleted(session, Stage, stage_ids)
+    edge = StageEdge.__table__
+    session.execute(edge.delete().where(or_(edge.c.parent_id.in_(stage_ids), edge.c.child_id.in_(stage_ids))))
+    session.execute(Stage.__table__.delete().where(where))
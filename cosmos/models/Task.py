@@ -1,20 +1,23 @@
 import os
 import json
+import hashlib
 import itertools as it
 import shutil
 import codecs
 import subprocess as sp
-from sqlalchemy.orm import relationship, synonym, backref
-from sqlalchemy.sql.expression import func
+from sqlalchemy import event
+from sqlalchemy.orm import relationship, synonym, backref, validates
+from sqlalchemy.orm.attributes import get_history, set_committed_value
+from sqlalchemy.sql.expression import func, select, or_, and_, bindparam
 from sqlalchemy.ext.declarative import declared_attr
-from sqlalchemy.schema import Column, ForeignKey
+from sqlalchemy.schema import Column, ForeignKey, UniqueConstraint, Index
 from sqlalchemy.types import Boolean, Integer, String, PickleType, DateTime, BigInteger, Text
 from sqlalchemy.ext.associationproxy import association_proxy
 from flask import url_for
 from networkx.algorithms import breadth_first_search
 
 from ..db import Base
-from ..util.sqla import Enum34_ColumnType, MutableDict, JSONEncodedDict
+from ..util.sqla import Enum34_ColumnType, MutableDict, JSONEncodedDict, expunge_deleted, bulk_insert
 from sqlalchemy_utils.types.json import JSONType
 from .. import TaskStatus, StageStatus, signal_task_status_change
 from ..util.helpers import wait_for_file
@@ -99,6 +102,21 @@ def task_status_changed(task):
 
 
 
+def tags_hash(tags):
+    """
+    :returns: (str) a digest of tags, which is the same for equal tags regardless of their order
+    """
+    return hashlib.sha1(json.dumps(tags, sort_keys=True, separators=(',', ':'))).hexdigest()
+
+
+def tag_value_hash(value):
+    """
+    :returns: (str) a digest of a tag's value, compared as a string, which the task_tag table is indexed by since
+        values can be too long to index
+    """
+    return hashlib.sha1(unicode(value).encode('utf-8')).hexdigest()
+
+
 def logplus(filename):
     prefix, suffix = os.path.splitext(filename)
     return property(lambda self: opj(self.log_dir, "{0}_attempt{1}{2}".format(prefix, self.attempt, suffix)))
@@ -133,13 +151,32 @@ class TaskEdge(Base):
         return self.__str__()
 
 
+class TaskTag(Base):
+    """
+    One of a Task's tags, so tasks can be found by tag with an index rather than by reading every task's tags.  Only
+    written for executions run by a Cosmos created with index_tags=True.  Values are stored as strings, and looked up
+    by their digest.
+    """
+    __tablename__ = 'task_tag'
+    __table_args__ = (Index('ix_task_tag_key_value_hash_task_id', 'key', 'value_hash', 'task_id'),)
+    task_id = Column(Integer, ForeignKey('task.id', ondelete="CASCADE"), primary_key=True)
+    key = Column(String(255), primary_key=True)
+    value = Column(Text, nullable=False)
+    value_hash = Column(String(40), nullable=False)
+
+    def __repr__(self):
+        return '<TaskTag[%s] %s=%s>' % (self.task_id, self.key, self.value)
+
+
 class Task(Base):
     __tablename__ = 'task'
     """
     A job that gets executed.  Has a unique set of tags within its Stage.
     """
-    # causes a problem with mysql.  its checked a the application level so should be okay
-    # __table_args__ = (UniqueConstraint('tags', 'stage_id', name='_uc1'),)
+    # tags can't be in a unique constraint with mysql, since they're text, so their digest is
+    __table_args__ = (UniqueConstraint('stage_id', 'tags_hash', name='_uc_stage_tags_hash'),
+                      Index('ix_task_stage_id_status', 'stage_id', '_status'),
+                      Index('ix_task_stage_id_successful', 'stage_id', 'successful'))
 
     id = Column(Integer, primary_key=True)
     mem_req = Column(Integer, default=None)
@@ -147,6 +184,9 @@ class Task(Base):
     time_req = Column(Integer)
     NOOP = Column(Boolean, default=False, nullable=False)
     tags = Column(MutableDict.as_mutable(JSONEncodedDict), nullable=False, server_default='{}')
+    tags_hash = Column(String(40), nullable=False, default=tags_hash(dict()))
+    # True once the task's tags have been written to the task_tag table, even if it has none
+    tags_indexed = Column(Boolean, default=False, nullable=False)
     stage_id = Column(ForeignKey('stage.id', ondelete="CASCADE"), nullable=False, index=True)
     log_dir = Column(String(255))
     output_dir = Column(String(255))
@@ -179,7 +219,7 @@ class Task(Base):
         return [ifa.taskfile for ifa in self._input_file_assocs]
 
     drm_native_specification = Column(String(255))
-    drm_jobID = Column(Integer)
+    drm_jobID = Column(String(255))
 
     profile_fields = ['wall_time', 'cpu_time', 'percent_cpu', 'user_time', 'system_time', 'io_read_count',
                       'io_write_count', 'io_read_kb', 'io_write_kb',
@@ -229,6 +269,11 @@ class Task(Base):
 
         return synonym('_status', descriptor=property(get_status, set_status))
 
+    @validates('tags')
+    def validate_tags(self, key, tags):
+        self.tags_hash = tags_hash(tags)
+        return tags
+
 
     @property
     def execution(self):
@@ -245,6 +290,7 @@ class Task(Base):
     _cache_profile = None
 
     output_profile_path = logplus('profile.json')
+    output_resource_series_path = logplus('resources.bin')
     output_command_script_path = logplus('command.bash')
     output_stderr_path = logplus('stderr.txt')
     output_stdout_path = logplus('stdout.txt')
@@ -293,24 +339,39 @@ class Task(Base):
                 raise IOError('%s does not exist on the filesystem' % self.output_profile_path)
         return self._cache_profile
 
+    def resource_series(self, columns=None):
+        """
+        The resource usage the profiler sampled while the task ran.  Only the `columns` asked for are read.
+
+        :param list columns: names from :data:`cosmos.job.profiler.SERIES_COLUMNS`, ex. ['time', 'rss_kb'].
+        :returns: (dict) column name -> array.array, or None if the task has no series.
+        """
+        if self.NOOP or not os.path.exists(self.output_resource_series_path):
+            return None
+        from ..job.profiler import read_series
+
+        return read_series(self.output_resource_series_path, columns)
+
     def update_from_profile_output(self):
         for k, v in self.profile.items():
             setattr(self, k, v)
 
     def all_predecessors(self, as_dict=False):
         """
-        :return: (list) all tasks that descend from this task in the task_graph
+        :param as_dict: Return a dict of each predecessor -> the task it was reached from, instead.
+        :return: (set) all tasks this task descends from in the task_graph
         """
-        d = breadth_first_search.bfs_predecessors(self.execution.task_graph().reverse(copy=False), self)
+        # traverse the edges backwards, rather than reversing the execution's graph, which is cached
+        d = dict((t, s) for s, t in breadth_first_search.bfs_edges(self.execution.task_graph(), self, reverse=True))
         if as_dict:
             return d
-        return set(d.values())
+        return set(d)
 
     def all_successors(self):
         """
-        :return: (list) all tasks that descend from this task in the task_graph
+        :return: (set) all tasks that descend from this task in the task_graph
         """
-        return set(breadth_first_search.bfs_successors(self.execution.task_graph(), self).values())
+        return set(t for _, t in breadth_first_search.bfs_edges(self.execution.task_graph(), self))
 
     @property
     def label(self):
@@ -328,13 +389,21 @@ class Task(Base):
     def delete(self, delete_files=False):
         self.log.debug('Deleting %s' % self)
         if delete_files:
-            for tf in self.output_files:
-                tf.delete(True)
-            if os.path.exists(self.log_dir):
-                shutil.rmtree(self.log_dir)
+            self.delete_files()
+
+        session = self.session
+        self.execution._task_graph = None
+        delete_tasks(session, Task.id == self.id)
+        session.commit()
 
-        self.session.delete(self)
-        self.session.commit()
+    def delete_files(self):
+        """
+        Deletes this task's output files and log_dir from the filesystem, but not its records
+        """
+        for tf in self.output_files:
+            tf.delete_file()
+        if self.log_dir and os.path.exists(self.log_dir):
+            shutil.rmtree(self.log_dir)
 
     @property
     def url(self):
@@ -347,3 +416,102 @@ class Task(Base):
     def __str__(self):
         return self.__repr__()
 
+
+@event.listens_for(Task, 'before_update')
+def _update_tags_hash(mapper, connection, task):
+    # tags changed in place don't go through validate_tags
+    if get_history(task, 'tags').has_changes():
+        task.tags_hash = tags_hash(task.tags)
+        if task.tags_indexed:
+            tt = TaskTag.__table__
+            rows = tag_rows(task.id, task.tags)
+            connection.execute(tt.delete().where(tt.c.task_id == task.id))
+            if rows:
+                connection.execute(tt.insert(), rows)
+
+
+def tag_rows(task_id, tags):
+    """:returns: (list) the TaskTag rows of a task's tags, as dicts"""
+    return [dict(task_id=task_id, key=k, value=unicode(v), value_hash=tag_value_hash(v)) for k, v in tags.items()]
+
+
+def index_task_tags(session, where):
+    """
+    Writes the tags of tasks that have not been indexed yet to the task_tag table, and marks those tasks as indexed,
+    so tasks without tags are not scanned again, and tasks whose tags change later are re-indexed.
+
+    :param where: criteria on Task selecting the tasks to index, ex. `Task.stage_id == 1`
+    """
+    not_indexed = and_(where, Task.tags_indexed == False)
+    new = session.query(Task.id, Task.tags).filter(not_indexed).all()
+    bulk_insert(session, TaskTag.__table__, [row for task_id, tags in new for row in tag_rows(task_id, tags)])
+    session.execute(Task.__table__.update().where(not_indexed).values(tags_indexed=True))
+
+    # update the tasks that are already loaded to match
+    task_ids = set(task_id for task_id, _ in new)
+    for instance in session.identity_map.values():
+        if isinstance(instance, Task) and instance.id in task_ids:
+            set_committed_value(instance, 'tags_indexed', True)
+
+
+def update_tags_hashes(session):
+    """
+    Sets the tags_hash of every task from its tags, ex. after the column was added to a database that has tasks.
+    """
+    t = Task.__table__
+    update = t.update().where(t.c.id == bindparam('_id')).values(tags_hash=bindparam('_tags_hash'))
+    rows = [dict(_id=task_id, _tags_hash=tags_hash(tags))
+            for task_id, tags in session.execute(select([t.c.id, t.c.tags]))]
+    if rows:
+        session.execute(update, rows)
+
+
+def filter_by_tags(query, tags):
+    """
+    :param query: a query that includes Task.
+    :param dict tags: tags the tasks must all have, with values compared as strings.
+    :returns: query, filtered to tasks with `tags` using the task_tag table.
+    """
+    for k, v in tags.items():
+        query = query.filter(Task.id.in_(select([TaskTag.task_id]).where(and_(TaskTag.key == k,
+                                                                             TaskTag.value_hash == tag_value_hash(v)))))
+    return query
+
+
+def count_by_tag(session, key, where, tags):
+    """
+    :param key: the tag to group by.
+    :param where: criteria on Task, ex. `Task.stage_id == 1`
+    :param dict tags: only count tasks that have all of these tags.
+    :returns: (dict) value of `key` -> number of tasks with it, using the task_tag table.
+    """
+    q = session.query(TaskTag.value, func.count(TaskTag.task_id)).join(Task, Task.id == TaskTag.task_id) \
+        .filter(TaskTag.key == key, where)
+    return dict(filter_by_tags(q, tags).group_by(TaskTag.value))
+
+
+def delete_tasks(session, where):
+    """
+    Deletes tasks, with their output TaskFiles, TaskEdges, TaskTags and InputFileAssociations, using a DELETE per
+    table in the session's transaction, rather than loading them to be deleted by the ORM.
+
+    :param where: criteria on Task selecting the tasks to delete, ex. `Task.stage_id == 1`
+    """
+    from .TaskFile import TaskFile
+
+    task_ids = select([Task.id]).where(where)
+    taskfile_ids = select([TaskFile.id]).where(TaskFile.task_output_for_id.in_(task_ids))
+    ifa = InputFileAssociation.__table__
+    ifa_where = or_(ifa.c.task_id.in_(task_ids), ifa.c.taskfile_id.in_(taskfile_ids))
+    edge = TaskEdge.__table__
+
+    expunge_deleted(session, InputFileAssociation, select([ifa.c.task_id, ifa.c.taskfile_id]).where(ifa_where))
+    expunge_deleted(session, TaskFile, taskfile_ids)
+    expunge_deleted(session, Task, task_ids)
+
+    # in dependency order, so each statement's subqueries still see the rows they select
+    session.execute(ifa.delete().where(ifa_where))
+    session.execute(TaskTag.__table__.delete().where(TaskTag.task_id.in_(task_ids)))
+    session.execute(edge.delete().where(or_(edge.c.parent_id.in_(task_ids), edge.c.child_id.in_(task_ids))))
+    session.execute(TaskFile.__table__.delete().where(TaskFile.task_output_for_id.in_(task_ids)))
+    session.execute(Task.__table__.delete().where(where))
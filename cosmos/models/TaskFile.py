@@ -104,7 +104,7 @@ class TaskFile(Base):
     id = Column(Integer, primary_key=True)
     task_output_for_id = Column(ForeignKey('task.id', ondelete="CASCADE"), index=True)
     order = Column(Integer, nullable=False)
-    path = Column(String(255), nullable=False)
+    path = Column(String(255), nullable=False, index=True)
     name = Column(String(255), nullable=False)
     format = Column(String(255), nullable=False)
     basename = Column(String(255), nullable=False)  # todo basename redundant with path?
@@ -151,9 +151,16 @@ class TaskFile(Base):
         Deletes this task and all files associated with it
         """
         self.log.debug('Deleting %s' % self)
+        if delete_file:
+            self.delete_file()
+        self.session.delete(self)
+        # self.session.commit()
 
-        #if not self.task_output_for.NOOP and delete_file and os.path.exists(self.path):
-        if not self.task_output_for.NOOP and delete_file and os.path.exists(self.path):
+    def delete_file(self):
+        """
+        Deletes this file from the filesystem, if it is inside its execution's output_dir
+        """
+        if not self.task_output_for.NOOP and os.path.exists(self.path):
             if not in_directory(self.path, self.execution.output_dir):
                 self.log.warn('Not deleting %s, outside of %s' % (self.path, self.execution.output_dir))
             else:
@@ -162,9 +169,6 @@ class TaskFile(Base):
                 else:
                     os.remove(self.path)
 
-        self.session.delete(self)
-        # self.session.commit()
-
 
 def in_directory(file, directory):
     # make both absolute
@@ -53,6 +53,9 @@ class Tool(object):
     persist = False
     drm = None
     skip_profile = False
+    profile_budget = None  # fraction of one core the profiler may spend sampling each task, see cosmos/job/profiler.py
+    nice = None  # niceness increment for local tasks
+    ionice = None  # io scheduling class for local tasks, ex. 'idle' or ('best_effort', 7)
     inputs = []  # class property!
     outputs = []  # class property!
     output_dir = None
@@ -174,6 +177,9 @@ class Tool(object):
         task = Task(stage=stage, tags=self.tags, _input_file_assocs=ifas, parents=parents, output_dir=self.output_dir,
                     **d)
         task.skip_profile = self.skip_profile
+        task.profile_budget = self.profile_budget
+        task.nice = self.nice
+        task.ionice = self.ionice
 
         inputs = unpack_taskfiles_with_cardinality_1(aif_2_input_taskfiles).values()
 
@@ -1,4 +1,7 @@
 import sqlalchemy.types as types
+from sqlalchemy import inspect, func, false
+from sqlalchemy.orm import make_transient_to_detached
+from sqlalchemy.orm.attributes import set_committed_value
 from sqlalchemy.ext.mutable import Mutable
 import six
 
@@ -104,4 +107,106 @@ class MutableDict(Mutable, dict):
         "Detect dictionary del events and emit change events."
 
         dict.__delitem__(self, key)
-        self.changed()
\ No newline at end of file
+        self.changed()
+
+def allocate_ids(session, model, instances):
+    """
+    Sets the primary keys of new instances to ids after the largest one in model's table, so they can be inserted
+    without a round trip per row.  SQLite only: it first takes the database's write lock, which is held until the
+    session's transaction ends, so no other connection can insert rows with the same ids.  Other databases allocate
+    ids from sequences, which this would bypass.
+    """
+    assert session.connection().dialect.name == 'sqlite', 'ids can only be allocated on SQLite'
+    # an UPDATE that matches nothing still begins a write transaction
+    session.execute(model.__table__.update().where(false()).values({model.id: model.id}))
+    next_id = (session.query(func.max(model.id)).scalar() or 0) + 1
+    for i, instance in enumerate(instances):
+        instance.id = next_id + i
+
+
+def insert_values(instance):
+    """
+    :returns: (dict) column key -> value of a new instance, for a Core insert.  Scalar column defaults are applied to
+        the instance for any columns it has not set, so it matches the inserted row.
+    """
+    values = dict()
+    for prop in inspect(instance).mapper.column_attrs:
+        column = prop.columns[0]
+        value = instance.__dict__.get(prop.key)
+        if value is None and column.default is not None and column.default.is_scalar:
+            value = column.default.arg
+            setattr(instance, prop.key, value)
+        values[column.key] = value
+    return values
+
+
+def bulk_insert(session, table, rows):
+    """Inserts rows, a list of dicts, with a single executemany"""
+    if rows:
+        session.execute(table.insert(), rows)
+
+
+def forget_changes(instance, key):
+    """
+    Makes the current value of the relationship `key` of instance, which is in the session, look as if it had been
+    loaded from the database, so flushing the instance does not write it.  A collection that has not been loaded only
+    holds pending changes, which are discarded.
+    """
+    state = inspect(instance)
+    if key in state.dict:
+        set_committed_value(instance, key, list(getattr(instance, key)))
+    else:
+        state.session.expire(instance, [key])
+
+
+def set_loaded(instances, key, values):
+    """
+    Sets the collection `key` of each instance that has not loaded it to values.get(instance, []), as if it had been
+    lazy loaded, so reading it does not run a query.  Changes pending on the collection are kept, as a lazy load would.
+
+    :param dict values: instance -> list of related instances, which were loaded from the database
+    """
+    for instance in instances:
+        # an unloaded or expired attribute is not in the instance's __dict__
+        if key not in instance.__dict__:
+            set_committed_value(instance, key, values.get(instance, []))
+
+
+def mark_persisted(session, instances, cascaded=()):
+    """
+    Adds new instances, whose rows were inserted with Core, to the session as if they had been loaded from the
+    database.  Their primary keys must be set.
+
+    :param cascaded: more new instances, which are reached from `instances` by save-update cascades.  Adding them
+        with their instances saves walking the cascades again for each.
+    """
+    for instance in list(instances) + list(cascaded):
+        make_transient_to_detached(instance)
+    session.add_all(instances)
+
+
+def query_plan(session, query):
+    """
+    :param query: a Query or a select.
+    :returns: (list of str) the steps of SQLite's EXPLAIN QUERY PLAN of query, with its parameters inlined.
+    """
+    statement = getattr(query, 'statement', query)
+    sql = statement.compile(dialect=session.bind.dialect, compile_kwargs={'literal_binds': True})
+    return [tuple(row)[-1] for row in session.execute('EXPLAIN QUERY PLAN %s' % sql)]
+
+
+def expunge_deleted(session, model, ids):
+    """
+    Expunges the instances of model in the session that are about to be deleted with a Core DELETE, so the session is
+    not left holding stale instances whose ids may be reused.
+
+    :param ids: a select of the primary keys of the rows that will be deleted
+    """
+    states = [state for state in session.identity_map.all_states() if issubclass(state.class_, model)]
+    if not states:
+        return
+    deleted = set(tuple(row) for row in session.execute(ids))
+    for state in states:
+        instance = state.obj()
+        if instance is not None and state.key[1] in deleted and instance in session:
+            session.expunge(instance)
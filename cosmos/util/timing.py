@@ -0,0 +1,94 @@
+import time
+import math
+import threading
+from collections import Counter
+from contextlib import contextmanager
+from functools import wraps
+
+
+class Timings(object):
+    """
+    Counts and durations of named spans of code, ex. the parts of the scheduler loop.  Durations are kept in a
+    histogram of power of 2 millisecond buckets, so recording is cheap and memory does not grow with the number of
+    spans.  Spans can be recorded from any thread.
+
+    >>> timings = Timings()
+    >>> with timings.span('session.commit'):
+    ...     session.commit()
+    """
+
+    def __init__(self):
+        self.spans = dict()  # name -> dict(count, total, max, buckets)
+        # reentrant, since the signal handlers of Execution.run() record and format timings on the main thread,
+        # which may be interrupted while it holds the lock
+        self._lock = threading.RLock()
+
+    @contextmanager
+    def span(self, name):
+        start = time.time()
+        try:
+            yield
+        finally:
+            self.record(name, time.time() - start)
+
+    def timed(self, name, func):
+        """:returns: `func`, wrapped so each call is recorded as a `name` span"""
+
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            with self.span(name):
+                return func(*args, **kwargs)
+
+        return wrapper
+
+    def record(self, name, seconds):
+        # bucket i holds durations of up to 2**i milliseconds
+        bucket = max(0, int(math.ceil(math.log(seconds * 1000, 2)))) if seconds > .001 else 0
+        with self._lock:
+            s = self.spans.get(name)
+            if s is None:
+                s = self.spans[name] = dict(count=0, total=0., max=0., buckets=Counter())
+            s['count'] += 1
+            s['total'] += seconds
+            s['max'] = max(s['max'], seconds)
+            s['buckets'][bucket] += 1
+
+    def snapshot(self):
+        """
+        :returns: (dict) span name -> dict(count, total, max, buckets), a copy that is safe to read while spans are
+            being recorded.  buckets maps i -> the number of spans that took up to 2**i milliseconds.
+        """
+        with self._lock:
+            return {name: dict(s, buckets=Counter(s['buckets'])) for name, s in self.spans.items()}
+
+    def summary(self):
+        """
+        :returns: (dict) span name -> dict(count, total, mean, p50, p95, max), in seconds.  Percentiles are the upper
+            bound of their histogram bucket.
+        """
+        spans = self.snapshot()
+        return {name: dict(count=s['count'],
+                           total=round(s['total'], 3),
+                           mean=round(s['total'] / s['count'], 4),
+                           p50=percentile(s['buckets'], s['count'], .5, s['max']),
+                           p95=percentile(s['buckets'], s['count'], .95, s['max']),
+                           max=round(s['max'], 4))
+                for name, s in spans.items()}
+
+    def format(self):
+        """:returns: (str) the summary as a table, slowest spans in total first"""
+        summary = self.summary()
+        lines = ['%-32s %8s %10s %10s %10s %10s %10s' % ('span', 'count', 'total', 'mean', 'p50', 'p95', 'max')]
+        for name, s in sorted(summary.items(), key=lambda (name, s): -s['total']):
+            lines.append('%-32s %8s %10.3f %10.4f %10.4f %10.4f %10.4f' % (
+                name, s['count'], s['total'], s['mean'], s['p50'], s['p95'], s['max']))
+        return '\n'.join(lines)
+
+
+def percentile(buckets, count, q, max_seconds):
+    seen = 0
+    for bucket in sorted(buckets):
+        seen += buckets[bucket]
+        if seen >= q * count:
+            return min(2 ** bucket / 1000., round(max_seconds, 4))
+    return round(max_seconds, 4)
@@ -1,13 +1,15 @@
 import itertools as it
 from operator import attrgetter
 
-from flask import Markup, render_template, Blueprint, redirect, url_for, flash, abort, request
+from flask import Markup, render_template, Blueprint, redirect, url_for, flash, abort, request, Response
 from sqlalchemy import desc
 
-from .. import Execution, Stage, Task, TaskStatus
+from .. import Execution, Stage, Task, TaskStatus, ExecutionStatus
 from ..job.JobManager import JobManager
 from . import filters
 from ..graph.draw import draw_task_graph, draw_stage_graph
+from ..graph.resources import draw_resource_series, MAX_TASKS
+from ..job.metrics import metrics_path, merge_metrics
 
 
 def gen_bprint(cosmos_app):
@@ -50,18 +52,50 @@ def gen_bprint(cosmos_app):
         stage = session.query(Stage).filter_by(execution_id=ex.id, name=stage_name).one()
         if stage is None:
             return abort(404)
-        submitted = filter(lambda t: t.status == TaskStatus.submitted, stage.tasks)
+        # the query string filters the tasks by tag, ex. ?sample=A
+        tasks = stage.get_tasks(**request.args.to_dict()) if request.args else stage.tasks
+        submitted = filter(lambda t: t.status == TaskStatus.submitted, tasks)
         jm = JobManager(cosmos_app.get_submit_args)
 
         f = attrgetter('drm')
         drm_statuses = {}
-        for drm, tasks in it.groupby(sorted(submitted, key=f), f):
-            drm_statuses.update(jm.drms[drm].drm_statuses(list(tasks)))
+        for drm, drm_tasks in it.groupby(sorted(submitted, key=f), f):
+            drm_statuses.update(jm.drms[drm].drm_statuses(list(drm_tasks)))
 
-        return render_template('cosmos/stage.html', stage=stage, drm_statuses=drm_statuses)
+        return render_template('cosmos/stage.html', stage=stage, tasks=tasks, drm_statuses=drm_statuses)
         # x=filter(lambda t: t.status == TaskStatus.submitted, stage.tasks))
 
 
+    @bprint.route('/execution/<execution_name>/<stage_name>/resources.svg')
+    def stage_resources(execution_name, stage_name):
+        ex = session.query(Execution).filter_by(name=execution_name).one()
+        stage = session.query(Stage).filter_by(execution_id=ex.id, name=stage_name).one()
+        columns = ['rss_kb', 'cpu_percent']
+        n = len(stage.tasks)
+        title = '%s of %s tasks, sampled evenly' % (MAX_TASKS, n) if n > MAX_TASKS else None
+        svg = draw_resource_series(stage.resource_series(columns, max_tasks=MAX_TASKS), columns, title)
+        return Response(svg, mimetype='image/svg+xml')
+
+
+    @bprint.route('/metrics')
+    def metrics():
+        """
+        Prometheus metrics of the running executions, which their schedulers write to their output_dirs
+        """
+        texts = []
+        running = session.query(Execution).filter(Execution.status.in_([ExecutionStatus.running,
+                                                                        ExecutionStatus.failed_but_running]))
+        for ex in running:
+            try:
+                with open(metrics_path(ex)) as fh:
+                    texts.append(fh.read())
+            except IOError:
+                # the scheduler has not written any yet
+                pass
+        session.expire_all()
+        return Response(merge_metrics(texts), mimetype='text/plain; version=0.0.4')
+
+
     @bprint.route('/execution/<int:ex_id>/stage/<stage_name>/delete/')
     def stage_delete(ex_id, stage_name):
         s = session.query(Stage).filter(Stage.execution_id == ex_id, Stage.name == stage_name).one()
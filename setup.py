@@ -35,7 +35,6 @@ setup(
     license="GPLv3",
     install_requires=[
         'gntp',
-        "psprofile",
         "Flask",
         'blinker',
         "sqlalchemy",